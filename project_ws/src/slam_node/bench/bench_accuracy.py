@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Pose accuracy of the filter engines on the synthetic maze worlds of
+# bench_scaling.py. Every run drives the lawnmower path of one world (one seed)
+# and records the position error after every scan. A run is summarized by the
+# mean of those errors and by the final one, and every engine and world size by
+# the median of the runs over the seeds, since a single run can diverge.
+# Usage: python bench_accuracy.py [--walls 25,100,400] [--seeds 5] [--engines ekf,seif,submap] [--out bench_accuracy.json]
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import slam_core
+from slam_core import make_filter
+from bench_scaling import make_maze, lawnmower_path, observe, git_revision
+
+
+def run_seed(task):
+    engine, n_walls, seed, args = task
+    slam_core.am_debugging = False
+    rng = np.random.RandomState(seed)
+    walls, extent = make_maze(n_walls, rng)
+    path = lawnmower_path(extent, args.scans, args.odom_per_scan)
+    params = {'engine': engine, 'r_t': args.r_t}
+    if engine == 'submap':
+        # Merged on this thread, so a run does not depend on how the merger thread gets scheduled
+        params['submap_background'] = False
+    slam = make_filter(params=params)
+    slam.init_pose(path[0,0], path[0,1], path[0,2])
+    slam.dX = 0
+    slam.dY = 0
+    slam.dT = 0
+    slam.poseInit = True
+    errors = []
+    for k in range(1, len(path)):
+        delta = path[k] - path[k-1] + rng.normal(0, args.noise/10, 3)
+        slam.odom_update(delta[0], delta[1], delta[2])
+        if k % args.odom_per_scan == 0:
+            slam.landmark_update(observe(walls, path[k], args.sensor_range, args.noise, rng))
+            errors.append(np.sqrt(np.sum(np.square(slam.x[0:2,0] - path[k,0:2]))))
+    return {'engine': engine, 'walls': n_walls, 'seed': seed, 'mean_error': float(np.mean(errors)),
+            'final_error': float(errors[-1]), 'landmarks': len(slam.landmarks)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SLAM pose accuracy on synthetic maze worlds, over several seeds')
+    parser.add_argument('--walls', default='25,100,400', help='comma separated world sizes (line landmarks)')
+    parser.add_argument('--seeds', type=int, default=5, help='worlds per size, seeds 0..n-1')
+    parser.add_argument('--engines', default='ekf,seif,submap', help='comma separated engines (see slam_core.make_filter)')
+    parser.add_argument('--scans', type=int, default=300, help='landmark scans per world')
+    parser.add_argument('--odom-per-scan', type=int, default=5)
+    parser.add_argument('--sensor-range', type=float, default=4.0)
+    parser.add_argument('--noise', type=float, default=0.02, help='observation noise (m), odometry noise is a tenth of it')
+    parser.add_argument('--r-t', type=float, default=0.25, help='association threshold given to SLAM')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--out', default='bench_accuracy.json')
+    args = parser.parse_args()
+
+    engines = args.engines.split(',')
+    sizes = [int(w) for w in args.walls.split(',')]
+    tasks = [(engine, n_walls, seed, args) for n_walls in sizes for engine in engines for seed in range(args.seeds)]
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        runs = pool.map(run_seed, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    print('%8s %8s %12s %12s   %s' % ('walls', 'engine', 'median mean', 'median final', 'mean error per seed (m)'))
+    summary = []
+    for n_walls in sizes:
+        for engine in engines:
+            mine = [r for r in runs if r['engine'] == engine and r['walls'] == n_walls]
+            row = {'engine': engine, 'walls': n_walls,
+                   'median_mean_error': float(np.median([r['mean_error'] for r in mine])),
+                   'median_final_error': float(np.median([r['final_error'] for r in mine]))}
+            summary.append(row)
+            print('%8d %8s %12.2f %12.2f   %s' % (n_walls, engine, row['median_mean_error'], row['median_final_error'],
+                                                 ' '.join(['%.1f' % r['mean_error'] for r in mine])))
+    with open(args.out, 'w') as f:
+        json.dump({'revision': git_revision(), 'args': dict((k, v) for k, v in vars(args).items() if k != 'out'),
+                   'summary': summary, 'runs': runs}, f, indent=2)
+    print('Results written to ' + args.out)
+
+
+if __name__ == '__main__':
+    main()
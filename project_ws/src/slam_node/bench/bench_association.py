@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Per-observation latency of landmark association against map size.
+# Compares the batched association engine, with and without the spatial grid,
+# with the old per-landmark loop. Landmark density is kept constant so the map
+# grows in area like a real maze does.
+# Usage: python bench_association.py [--sizes 10,100,1000] [--reps 200]
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from association import associate, landmark_positions
+from spatial_index import LandmarkGrid
+
+
+def make_state(n_landmarks, rng):
+    # Random pose plus landmarks scattered around it with a valid covariance
+    n = 3 + 2*n_landmarks
+    extent = 2*np.sqrt(n_landmarks) + 5
+    x = np.zeros((n, 1))
+    x[0:3, 0] = rng.uniform(-1, 1, 3)
+    x[3:, 0] = rng.uniform(-extent, extent, 2*n_landmarks)
+    A = rng.normal(0, 0.05, (n, n))
+    P = np.matmul(A, A.T) + 0.1*np.eye(n)
+    return x, P
+
+
+def legacy_association(x, P, meas_landmark, R):
+    # The loop landmark_update used before batching, kept for comparison
+    num_landmarks = int((len(x)-3)/2)
+    residuals = np.array([])
+    for i in range(num_landmarks):
+        pred_landmark = np.array([x[3+2*(i),0],x[4+2*(i),0]])
+        pred_range = np.sqrt(np.square(pred_landmark[0]-x[0,0])+np.square(pred_landmark[1]-x[1,0]))
+        hr1 = np.array([(x[0,0]-pred_landmark[0])/pred_range, (x[1,0]-pred_landmark[1])/pred_range, 0])
+        hr2 = np.array([(pred_landmark[1]-x[1,0])/np.square(pred_range), (pred_landmark[0]-x[0,0])/np.square(pred_range), -1])
+        for val in range(num_landmarks):
+            if val == i:
+                hr1 = np.append(hr1,[-(x[0,0]-pred_landmark[0])/pred_range, -(x[1,0]-pred_landmark[1])/pred_range])
+                hr2 = np.append(hr2,[-(pred_landmark[1]-x[1,0])/np.square(pred_range), -(pred_landmark[0]-x[0,0])/np.square(pred_range)])
+            else:
+                hr1 = np.append(hr1,[0, 0])
+                hr2 = np.append(hr2,[0, 0])
+        H = np.vstack((hr1,hr2))
+        Kappa = np.matmul(H,np.matmul(P,np.transpose(H))) + R
+        rsD = 0.5*np.sqrt(np.matmul((meas_landmark-pred_landmark),np.transpose(meas_landmark-pred_landmark)))
+        residuals = np.append(residuals, rsD)
+    ind = int(np.argmin(np.absolute(residuals)))
+    return ind, residuals[ind]
+
+
+def time_call(fn, reps):
+    start = time.time()
+    for _ in range(reps):
+        fn()
+    return (time.time() - start)/reps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Association latency against landmark count')
+    parser.add_argument('--sizes', default='10,50,100,200,500,1000,2000,5000')
+    parser.add_argument('--reps', type=int, default=200)
+    parser.add_argument('--legacy-max', type=int, default=200,
+                        help='largest map to time with the old loop (it is O(N^2))')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    R = np.array([[0.3, 0], [0, 0.045]])
+    print('%8s %14s %14s %14s %14s %14s' % ('N', 'residual (us)', 'mahalanobis', 'grid resid.', 'grid mahal.', 'legacy (us)'))
+    for n_landmarks in [int(s) for s in args.sizes.split(',')]:
+        x, P = make_state(n_landmarks, rng)
+        meas = x[3:5, 0].reshape(1, 2) + rng.normal(0, 0.1, (1, 2))
+        lm_pos = landmark_positions(x)
+        grid = LandmarkGrid(2.0)
+        grid.rebuild(lm_pos)
+
+        def grid_assoc(mahalanobis):
+            candidates = grid.query(meas[0], 2.0, landmark_positions(x))
+            return associate(x, P, meas, R, mahalanobis, True, candidates)
+        t_res = time_call(lambda: associate(x, P, meas, R), args.reps)
+        t_mah = time_call(lambda: associate(x, P, meas, R, mahalanobis=True), args.reps)
+        t_gres = time_call(lambda: grid_assoc(False), args.reps)
+        t_gmah = time_call(lambda: grid_assoc(True), args.reps)
+        assert grid_assoc(False)[0] == associate(x, P, meas, R)[0]
+        if n_landmarks <= args.legacy_max:
+            ind, gate = associate(x, P, meas, R)
+            leg_ind, leg_gate = legacy_association(x, P, meas, R)
+            assert ind == leg_ind and np.isclose(gate, leg_gate)
+            t_leg = '%14.1f' % (1e6*time_call(lambda: legacy_association(x, P, meas, R), max(1, args.reps//20)))
+        else:
+            t_leg = '%14s' % '-'
+        print('%8d %14.1f %14.1f %14.1f %14.1f %s' % (n_landmarks, 1e6*t_res, 1e6*t_mah, 1e6*t_gres, 1e6*t_gmah, t_leg))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Covariance storage benchmark on the bench_scaling maze worlds.
+# The same odometry and scans are fed in lockstep to one filter per storage:
+# dense float64, packed float64 and packed with a float32 landmark block, plus
+# a dense filter without odometry preintegration as the reference for how far
+# plain rounding differences drift. After every scan the state and covariance
+# of each filter are compared with the dense one. The filter amplifies small
+# differences, so on long runs their association decisions eventually differ:
+# the number of scans until then is reported with the largest differences over
+# the first --horizon scans. Memory held by the covariance, update latency and
+# the final pose error are printed and written to a JSON file.
+# Usage: python bench_covariance.py [--walls 25,100,400] [--scans 200] [--horizon 20] [--out bench_covariance.json]
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import slam_core
+from slam_core import SLAM
+from replay import Landmark, LandmarkArray
+from bench_scaling import make_maze, lawnmower_path, observe, percentiles, git_revision
+
+STORAGES = [('dense', {'covariance': 'dense'}),
+            ('rounding', {'covariance': 'dense', 'preintegrate': False}),
+            ('packed', {'covariance': 'packed'}),
+            ('packed32', {'covariance': 'packed', 'cov_float32': True})]
+
+
+def make_events(walls, path, args, rng):
+    # Odometry deltas, with a scan every odom_per_scan of them
+    events = []
+    for k in range(1, len(path)):
+        delta = path[k] - path[k-1] + rng.normal(0, args.noise/10, 3)
+        scan = None
+        if k % args.odom_per_scan == 0:
+            scan = observe(walls, path[k], args.sensor_range, args.noise, rng)
+        events.append((delta, scan))
+    return events
+
+
+def start_slam(path, args, params):
+    slam = SLAM(params=dict(params, r_t=args.r_t))
+    slam.init_pose(path[0,0], path[0,1], path[0,2])
+    slam.dX = 0
+    slam.dY = 0
+    slam.dT = 0
+    slam.poseInit = True
+    return slam
+
+
+def run_world(n_walls, args):
+    rng = np.random.RandomState(args.seed)
+    walls, extent = make_maze(n_walls, rng)
+    path = lawnmower_path(extent, args.scans, args.odom_per_scan)
+    events = make_events(walls, path, args, rng)
+    slams = [start_slam(path, args, params) for name, params in STORAGES]
+    lm_times = [[] for s in slams]
+    # Scans each filter kept the same map as the dense one, and its largest differences from it over the horizon
+    agree = [0 for s in slams]
+    max_dx = [0.0 for s in slams]
+    max_dP = [0.0 for s in slams]
+    for delta, scan in events:
+        for s in slams:
+            s.odom_update(delta[0], delta[1], delta[2])
+        if scan is None:
+            continue
+        for i, s in enumerate(slams):
+            t = time.time()
+            # Landmark messages are written to by landmark_update, give every filter its own
+            s.landmark_update(LandmarkArray([Landmark(l.x, l.y, l.radius, l.angle) for l in scan.landmarks]))
+            lm_times[i].append(time.time() - t)
+        ref = slams[0]
+        for i, s in enumerate(slams):
+            # Same landmarks with the same observation counts means the same association decisions
+            if agree[i] < len(lm_times[0]) - 1 or not np.array_equal(s.lm_obs, ref.lm_obs):
+                continue
+            agree[i] = len(lm_times[0])
+            if agree[i] > args.horizon:
+                continue
+            P_ref = ref.P
+            max_dx[i] = max(max_dx[i], float(np.max(np.abs(s.x - ref.x))))
+            max_dP[i] = max(max_dP[i], float(np.max(np.abs(s.P - P_ref))/np.max(np.abs(P_ref))))
+    results = []
+    for i, (name, params) in enumerate(STORAGES):
+        s = slams[i]
+        results.append({'walls': n_walls, 'storage': name, 'landmarks': len(s.landmarks), 'state_size': len(s.x),
+                        'cov_bytes': s.memory_usage()['covariance'], 'landmark_update': percentiles(lm_times[i]),
+                        'agree_scans': agree[i], 'max_dx': max_dx[i], 'max_dP_rel': max_dP[i],
+                        'pose_error': float(np.sqrt(np.sum(np.square(s.x[0:2,0] - path[-1,0:2]))))})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dense vs packed covariance storage on synthetic maze worlds')
+    parser.add_argument('--walls', default='25,100,400', help='comma separated world sizes (line landmarks)')
+    parser.add_argument('--scans', type=int, default=200, help='landmark scans per world')
+    parser.add_argument('--odom-per-scan', type=int, default=5)
+    parser.add_argument('--sensor-range', type=float, default=4.0)
+    parser.add_argument('--noise', type=float, default=0.02, help='observation noise (m), odometry noise is a tenth of it')
+    parser.add_argument('--r-t', type=float, default=0.25, help='association threshold given to SLAM')
+    parser.add_argument('--horizon', type=int, default=20, help='scans over which the differences are measured')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='bench_covariance.json')
+    args = parser.parse_args()
+
+    slam_core.am_debugging = False
+    results = []
+    print('%8s %10s %10s %10s %12s %12s %8s %10s %12s %10s' % ('walls', 'storage', 'landmarks', 'cov MB', 'update p50',
+                                                               'update p99', 'agree', 'max dx', 'max dP rel', 'pose err'))
+    for n_walls in [int(s) for s in args.walls.split(',')]:
+        for result in run_world(n_walls, args):
+            results.append(result)
+            print('%8d %10s %10d %10.2f %12.1f %12.1f %8d %10.1e %12.1e %10.3f' % (
+                n_walls, result['storage'], result['landmarks'], result['cov_bytes']/1e6,
+                result['landmark_update']['p50_us'], result['landmark_update']['p99_us'], result['agree_scans'],
+                result['max_dx'], result['max_dP_rel'], result['pose_error']))
+
+    report = {'revision': git_revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(), 'numpy': np.__version__,
+              'params': vars(args), 'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to ' + args.out)
+
+
+if __name__ == '__main__':
+    main()
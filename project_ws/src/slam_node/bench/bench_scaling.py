@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Filter scaling benchmark on synthetic maze worlds.
+# For every world size a maze of line walls is generated, the robot drives a
+# scripted lawnmower path through it and odometry plus lm_array shaped scans
+# are fed to SLAM. Per-call latency percentiles, throughput and peak memory are
+# printed and written to a JSON file so runs can be compared between versions.
+# Usage: python bench_scaling.py [--walls 50,200,1000] [--scans 200] [--engine ekf|seif|submap] [--out bench_scaling.json]
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import slam_core
+from slam_core import make_filter
+from replay import Landmark, LandmarkArray
+
+
+def make_maze(n_walls, rng, spacing=2.0):
+    # Walls on a square grid of cells, alternating orientation with some jitter so no two walls share a line.
+    # Returns (n,4) rows of centre x, centre y, half length, angle
+    side = int(np.ceil(np.sqrt(n_walls)))
+    cells = np.array([(i, j) for i in range(side) for j in range(side)])[0:n_walls]
+    walls = np.zeros((n_walls, 4))
+    walls[:,0] = (cells[:,0] + 0.5)*spacing + rng.uniform(-0.3, 0.3, n_walls)
+    walls[:,1] = (cells[:,1] + 0.5)*spacing + rng.uniform(-0.3, 0.3, n_walls)
+    walls[:,2] = rng.uniform(0.3, 0.8, n_walls)*spacing/2
+    walls[:,3] = np.where((cells[:,0] + cells[:,1]) % 2 == 0, 0.0, np.pi/2) + rng.uniform(-0.3, 0.3, n_walls)
+    return walls, side*spacing
+
+
+def lawnmower_path(extent, n_scans, odom_per_scan):
+    # Poses along back and forth lanes covering the square [0, extent]^2
+    lanes = max(2, int(extent/2.0))
+    points = []
+    for lane in range(lanes):
+        y = (lane + 0.5)*extent/lanes
+        xs = [0.1*extent, 0.9*extent]
+        if lane % 2 == 1:
+            xs.reverse()
+        points.append((xs[0], y))
+        points.append((xs[1], y))
+    points = np.array(points)
+    seg = np.sqrt(np.sum(np.square(np.diff(points, axis=0)), axis=1))
+    dist = np.concatenate(([0], np.cumsum(seg)))
+    samples = np.linspace(0, dist[-1], n_scans*odom_per_scan + 1)
+    xs = np.interp(samples, dist, points[:,0])
+    ys = np.interp(samples, dist, points[:,1])
+    heading = np.arctan2(np.gradient(ys), np.gradient(xs))
+    return np.column_stack((xs, ys, heading))
+
+
+def observe(walls, pose, sensor_range, noise, rng):
+    # lm_array shaped scan of the walls within range, in the robot frame
+    d = walls[:,0:2] - pose[0:2]
+    visible = np.nonzero(np.sum(np.square(d), axis=1) < sensor_range*sensor_range)[0]
+    c, s = np.cos(pose[2]), np.sin(pose[2])
+    landmarks = []
+    for i in visible:
+        lx = c*d[i,0] + s*d[i,1] + rng.normal(0, noise)
+        ly = -s*d[i,0] + c*d[i,1] + rng.normal(0, noise)
+        landmarks.append(Landmark(lx, ly, walls[i,2], walls[i,3] - pose[2] + rng.normal(0, noise/10)))
+    return LandmarkArray(landmarks)
+
+
+def percentiles(samples):
+    samples = 1e6*np.array(samples)
+    if len(samples) == 0:
+        return {}
+    return {'mean_us': float(samples.mean()), 'p50_us': float(np.percentile(samples, 50)),
+            'p90_us': float(np.percentile(samples, 90)), 'p99_us': float(np.percentile(samples, 99)),
+            'max_us': float(samples.max()), 'calls': int(len(samples))}
+
+
+def run_world(n_walls, args, rng, measure_memory=False):
+    walls, extent = make_maze(n_walls, rng)
+    path = lawnmower_path(extent, args.scans, args.odom_per_scan)
+    slam = make_filter(params={'engine': args.engine, 'r_t': args.r_t})
+    slam.init_pose(path[0,0], path[0,1], path[0,2])
+    slam.dX = 0
+    slam.dY = 0
+    slam.dT = 0
+    slam.poseInit = True
+    odom_times = []
+    lm_times = []
+    if measure_memory:
+        tracemalloc.start()
+    start = time.time()
+    for k in range(1, len(path)):
+        delta = path[k] - path[k-1] + rng.normal(0, args.noise/10, 3)
+        slam.data['real_pose'] = path[k,0:2].reshape(2,1)
+        t = time.time()
+        slam.odom_update(delta[0], delta[1], delta[2])
+        odom_times.append(time.time() - t)
+        if k % args.odom_per_scan == 0:
+            scan = observe(walls, path[k], args.sensor_range, args.noise, rng)
+            t = time.time()
+            slam.landmark_update(scan)
+            lm_times.append(time.time() - t)
+    elapsed = time.time() - start
+    result = {'walls': n_walls, 'landmarks': len(slam.landmarks), 'state_size': len(slam.x),
+              'odom_update': percentiles(odom_times), 'landmark_update': percentiles(lm_times),
+              'scans_per_s': len(lm_times)/elapsed, 'odom_per_s': len(odom_times)/elapsed,
+              'pose_error': float(np.sqrt(np.sum(np.square(slam.x[0:2,0] - path[-1,0:2]))))}
+    if measure_memory:
+        result['peak_mem_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SLAM scaling benchmark on synthetic maze worlds')
+    parser.add_argument('--walls', default='25,100,400', help='comma separated world sizes (line landmarks)')
+    parser.add_argument('--scans', type=int, default=200, help='landmark scans per world')
+    parser.add_argument('--odom-per-scan', type=int, default=5)
+    parser.add_argument('--sensor-range', type=float, default=4.0)
+    parser.add_argument('--noise', type=float, default=0.02, help='observation noise (m), odometry noise is a tenth of it')
+    parser.add_argument('--r-t', type=float, default=0.25, help='association threshold given to SLAM')
+    parser.add_argument('--engine', choices=['ekf', 'seif', 'submap'], default='ekf', help='filter engine (see slam_core.make_filter)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the (slower) tracemalloc pass')
+    parser.add_argument('--out', default='bench_scaling.json')
+    args = parser.parse_args()
+
+    slam_core.am_debugging = False
+    results = []
+    print('%8s %10s %12s %12s %12s %12s %10s %12s' % ('walls', 'landmarks', 'odom p50', 'odom p99',
+                                                        'update p50', 'update p99', 'scans/s', 'peak MB'))
+    for n_walls in [int(s) for s in args.walls.split(',')]:
+        result = run_world(n_walls, args, np.random.RandomState(args.seed))
+        if not args.no_memory:
+            result['peak_mem_bytes'] = run_world(n_walls, args, np.random.RandomState(args.seed), True)['peak_mem_bytes']
+        results.append(result)
+        print('%8d %10d %12.1f %12.1f %12.1f %12.1f %10.1f %12s' % (
+            n_walls, result['landmarks'], result['odom_update']['p50_us'], result['odom_update']['p99_us'],
+            result['landmark_update']['p50_us'], result['landmark_update']['p99_us'], result['scans_per_s'],
+            '-' if args.no_memory else '%.1f' % (result['peak_mem_bytes']/1e6)))
+
+    report = {'revision': git_revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(), 'numpy': np.__version__,
+              'params': vars(args), 'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to ' + args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Batched data association for the SLAM filter. Everything in here works on all
+# stored landmarks at once so the cost of an observation is a handful of NumPy
+# calls instead of a Python loop over the map.
+import numpy as np
+from innovation import batched_cholesky, batched_mahalanobis
+from line_model import predict_lines, align_observations, line_innovations
+
+
+def landmark_positions(x):
+    # View of the stored landmark positions as an (N,2) array
+    return x[3:, 0].reshape(-1, 2)
+
+
+def covariance_blocks(P, idx):
+    # Pose block (3,3), pose/landmark blocks (N,3,2) and landmark blocks (N,2,2)
+    # of a dense P for the landmark indices idx
+    ix = 3 + 2*idx
+    iy = ix + 1
+    Ppm = np.empty((len(idx), 3, 2))
+    Ppm[:, :, 0] = np.transpose(P[0:3, ix])
+    Ppm[:, :, 1] = np.transpose(P[0:3, iy])
+    Pmm = np.empty((len(idx), 2, 2))
+    Pmm[:, 0, 0] = P[ix, ix]
+    Pmm[:, 0, 1] = P[ix, iy]
+    Pmm[:, 1, 0] = P[iy, ix]
+    Pmm[:, 1, 1] = P[iy, iy]
+    return P[0:3, 0:3], Ppm, Pmm
+
+
+def innovation_covariances(P, Hx, Hm, R, idx=None):
+    # S_i = H_i P H_i^T + R for every landmark i using only the five non-zero
+    # columns of each H_i, its pose part Hx (N,rows,3) and landmark part Hm
+    # (N,rows,2), shape (N,rows,rows). idx gives the landmark index of every
+    # row of Hx when it is not the whole map. P is either a dense matrix or
+    # one of the covariance.py backends.
+    N = Hx.shape[0]
+    if idx is None:
+        idx = np.arange(N)
+    if hasattr(P, 'blocks'):
+        Ppp, Ppm, Pmm = P.blocks(idx)
+    else:
+        Ppp, Ppm, Pmm = covariance_blocks(P, idx)
+    HxT = Hx.transpose(0, 2, 1)
+    HmT = Hm.transpose(0, 2, 1)
+    cross = np.matmul(np.matmul(Hx, Ppm), HmT)
+    S = np.matmul(np.matmul(Hx, Ppp), HxT) \
+        + cross + cross.transpose(0, 2, 1) \
+        + np.matmul(np.matmul(Hm, Pmm), HmT)
+    return S + R
+
+
+def mahalanobis_distances(err, S):
+    # err^T S^-1 err for a stack of 1x1 or 2x2 innovations, through their Cholesky factors
+    return batched_mahalanobis(batched_cholesky(S), err)
+
+
+def associate(x, P, meas_landmark, R=None, mahalanobis=False, use_bearing=True, candidates=None):
+    # Score the measured landmark point against every stored landmark (or just
+    # the landmark indices in candidates) in one pass and return
+    # (index, gate value) of the best match, or (None, None) when there is
+    # nothing to match. The gate value is either half the euclidean distance
+    # between the points or the squared mahalanobis distance of the robot
+    # frame (rho, phi) innovation of the line (see line_model.predict_lines).
+    lm_pos = landmark_positions(x)
+    if candidates is not None:
+        lm_pos = lm_pos[candidates]
+    if len(lm_pos) == 0:
+        return None, None
+    meas = np.asarray(meas_landmark, dtype=float).reshape(2)
+    if not mahalanobis:
+        scores = 0.5*np.sqrt(np.sum(np.square(lm_pos - meas), axis=1))
+    else:
+        pose = x[0:3, 0]
+        rows = 2 if use_bearing else 1
+        pred, Hx, Hm = predict_lines(pose, lm_pos)
+        # The measured point was placed from the observed line at this pose, so predicting it gives that line back
+        z = align_observations(predict_lines(pose, meas.reshape(1, 2))[0], pred)
+        err = line_innovations(z, pred)[:, 0:rows]
+        S = innovation_covariances(P, Hx[:, 0:rows], Hm[:, 0:rows], np.atleast_2d(R), candidates)
+        scores = mahalanobis_distances(err, S)
+    best = int(np.argmin(scores))
+    if candidates is not None:
+        return int(candidates[best]), scores[best]
+    return best, scores[best]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Checkpoints of the filter state as plain .npy files. Two slot directories are
+# used in turn: a checkpoint is written into the slot not currently in use and
+# the 'latest' symlink is then swapped over to it with an atomic rename, so a
+# crash mid-write always leaves the previous checkpoint intact. Loading maps
+# the files and copies them straight into the SLAM buffers. The covariance is
+# stored as its store keeps it (see covariance.py and seif.py), any store can
+# load any form.
+import os
+import numpy as np
+from association import landmark_positions
+
+SLOTS = ('slot_a', 'slot_b')
+# Scalars kept next to the arrays, NaN stands in for None
+META = ('t1', 'dX', 'dY', 'dT', 'time_delta', 'scan', 'pruned', 'merged')
+# Engines whose whole state is one filter (see slam_core.make_filter), the submap engine is not
+ENGINES = ('ekf', 'seif')
+COVARIANCE = ('P', 'pp', 'pl', 'll', 'Omega_data', 'Omega_indices', 'Omega_indptr', 'xi')
+
+
+def _latest(path):
+    link = os.path.join(path, 'latest')
+    if not os.path.islink(link):
+        return None
+    return os.path.join(path, os.readlink(link))
+
+
+def _write(slot, name, array):
+    out = np.lib.format.open_memmap(os.path.join(slot, name + '.npy'), mode='w+', dtype=array.dtype, shape=array.shape)
+    out[...] = array
+    out.flush()
+    del out
+
+
+def save(slam, path):
+    # Write x, the covariance, the landmark tables and the odometry timing state of slam, returns the slot written
+    if slam.ENGINE not in ENGINES:
+        raise ValueError('Checkpoints of the %s engine are not supported' % slam.ENGINE)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    latest = _latest(path)
+    name = SLOTS[1] if latest is not None and os.path.basename(latest) == SLOTS[0] else SLOTS[0]
+    slot = os.path.join(path, name)
+    if not os.path.isdir(slot):
+        os.makedirs(slot)
+    # Pending odometry lives outside P, apply it so the checkpoint is self contained
+    slam.flush_odometry()
+    _write(slot, 'x', slam.x)
+    arrays = slam.cov.arrays()
+    for key in COVARIANCE:
+        if key in arrays:
+            _write(slot, key, arrays[key])
+        elif os.path.isfile(os.path.join(slot, key + '.npy')):
+            # Left over from a checkpoint of another store
+            os.remove(os.path.join(slot, key + '.npy'))
+    _write(slot, 'landmarks', slam.landmarks)
+    _write(slot, 'lm_obs', slam.lm_obs)
+    meta = [getattr(slam, key) for key in META]
+    _write(slot, 'meta', np.array([np.nan if v is None else v for v in meta], dtype=float))
+    tmp = os.path.join(path, 'latest.tmp')
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(name, tmp)
+    os.rename(tmp, os.path.join(path, 'latest'))
+    return slot
+
+
+def exists(path):
+    latest = _latest(path)
+    return latest is not None and os.path.isfile(os.path.join(latest, 'meta.npy'))
+
+
+def load(slam, path):
+    # Restore the latest checkpoint under path into slam, which is left initialized
+    if slam.ENGINE not in ENGINES:
+        raise ValueError('Checkpoints of the %s engine are not supported' % slam.ENGINE)
+    slot = _latest(path)
+    if slot is None:
+        raise IOError('No checkpoint in ' + path)
+    x = np.load(os.path.join(slot, 'x.npy'), mmap_mode='r')
+    n = len(x)
+    slam._reserve(n)
+    slam._set_size(n)
+    slam.x[...] = x
+    arrays = dict([(key, np.load(os.path.join(slot, key + '.npy'), mmap_mode='r')) for key in COVARIANCE
+                   if os.path.isfile(os.path.join(slot, key + '.npy'))])
+    # The information form needs the mean to rebuild xi from a covariance
+    arrays['x'] = x
+    slam.cov.restore(arrays)
+    slam.landmarks[...] = np.load(os.path.join(slot, 'landmarks.npy'), mmap_mode='r')
+    slam.lm_obs[...] = np.load(os.path.join(slot, 'lm_obs.npy'), mmap_mode='r')
+    meta = np.load(os.path.join(slot, 'meta.npy'))
+    for key, value in zip(META, meta):
+        setattr(slam, key, None if np.isnan(value) else value)
+    slam.scan = int(slam.scan)
+    slam.pruned = int(slam.pruned)
+    slam.merged = int(slam.merged)
+    slam._odometry_flushed()
+    slam.grid.rebuild(landmark_positions(slam.x))
+    slam.poseInit = True
+    slam.data['state'] = slam.x
+    slam.data['lm_info'] = slam.landmarks
+    return slot
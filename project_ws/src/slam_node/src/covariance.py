@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Storage backends for the filter covariance. SLAM only touches P through the
+# methods below, so the dense matrix can be swapped for the packed one on large
+# maps. Both hold a symmetric P over the state [pose (3), landmark 0 (2), ...]
+# and grow by reserve() / resize() alongside the state buffers.
+import numpy as np
+from association import covariance_blocks
+
+UPDATE_BLOCK = 64   # Rows of P corrected per step of rank_update, the size of the caller's scratch buffer
+
+
+class DenseCovariance():
+    # The full n x n float64 matrix, in a buffer that doubles when full. P is a view of its active part
+    def __init__(self, cap, pose_cov):
+        self.buf = np.zeros((cap, cap))
+        self.buf[0:3, 0:3] = pose_cov
+        self.resize(3)
+
+    def reserve(self, cap):
+        if cap <= len(self.buf):
+            return
+        buf = np.zeros((cap, cap))
+        buf[0:self.n, 0:self.n] = self.P
+        self.buf = buf
+        self.resize(self.n)
+
+    def resize(self, n):
+        self.n = n
+        self.P = self.buf[0:n, 0:n]
+
+    def pose_block(self):
+        return self.P[0:3, 0:3]
+
+    def cross(self):
+        # Pose/landmark block P[0:3, 3:]
+        return self.P[0:3, 3:self.n]
+
+    def set_cross(self, M):
+        self.P[0:3, 3:self.n] = M
+        self.P[3:self.n, 0:3] = np.transpose(M)
+
+    def add_landmark(self, G, L, C):
+        # Fill the rows/columns of the last landmark (resize has already made room): G is its cross
+        # covariance with the pose (3,2), L with the other landmarks (2,n-5), C its own block
+        n = self.n - 2
+        self.P[0:3, n:n+2] = G
+        self.P[3:n, n:n+2] = np.transpose(L)
+        self.P[n:n+2, 0:3] = np.transpose(G)
+        self.P[n:n+2, 3:n] = L
+        self.P[n:n+2, n:n+2] = C
+
+    def pose_rows(self, out=None):
+        # P[0:3, :], out is scratch space (3,>=n) backends that do not store rows may fill
+        return self.P[0:3, :]
+
+    def landmark_rows(self, i, out=None):
+        # P[3+2i:5+2i, :]
+        return self.P[3+2*i:5+2*i, :]
+
+    def blocks(self, idx):
+        return covariance_blocks(self.P, idx)
+
+    def rank_update(self, KT, HP, tmp):
+        # P -= K*(H*P) with K = KT^T, UPDATE_BLOCK rows at a time through tmp (>= UPDATE_BLOCK, n)
+        for b in range(0, self.n, UPDATE_BLOCK):
+            end = min(b+UPDATE_BLOCK, self.n)
+            block = tmp[0:end-b, 0:self.n]
+            np.matmul(np.transpose(KT[:, b:end]), HP, out=block)
+            self.P[b:end] -= block
+
+    def compact(self, keep):
+        # Keep only the state entries keep (sorted), resize must follow
+        m = len(keep)
+        self.P[0:m, 0:m] = self.P[np.ix_(keep, keep)]
+
+    def dense(self):
+        return self.P
+
+    def arrays(self):
+        # What a checkpoint has to store
+        return {'P': self.P}
+
+    def restore(self, arrays):
+        self.P[...] = dense_covariance(arrays)
+
+    def nbytes(self):
+        return self.buf.nbytes
+
+
+def _slab_start(i):
+    # Offset of landmark i's rows in the packed landmark block
+    return 2*i*(i + 1)
+
+
+def packed_to_dense(pp, pl, ll):
+    n = 3 + pl.shape[1]
+    P = np.empty((n, n))
+    P[0:3, 0:3] = pp
+    P[0:3, 3:] = pl
+    P[3:, 0:3] = np.transpose(pl)
+    for i in range((n - 3)//2):
+        slab = np.reshape(ll[_slab_start(i):_slab_start(i + 1)], (2, 2*(i + 1)))
+        P[3+2*i:5+2*i, 3:5+2*i] = slab
+        P[3:3+2*i, 3+2*i:5+2*i] = np.transpose(slab[:, 0:2*i])
+    return P
+
+
+def dense_covariance(arrays):
+    # Dense P from the arrays() of any covariance or information store (seif.py), for checkpoints written
+    # with another store than the one loading them
+    if 'P' in arrays:
+        return arrays['P']
+    if 'll' in arrays:
+        return packed_to_dense(arrays['pp'], arrays['pl'], arrays['ll'])
+    indptr = arrays['Omega_indptr']
+    n = len(indptr) - 1
+    Omega = np.zeros((n, n))
+    Omega[np.repeat(np.arange(n), np.diff(indptr)), arrays['Omega_indices']] = arrays['Omega_data']
+    return np.linalg.inv(Omega)
+
+
+class PackedCovariance():
+    # Only the lower triangle of P, in 2x2 landmark blocks. The pose block pp (3,3) and the pose/landmark
+    # block pl (3,n-3) are dense float64. The landmark rows are packed one landmark at a time: landmark i
+    # keeps its two rows up to and including its own diagonal block, 2 x 2(i+1) values at _slab_start(i),
+    # so a new landmark is appended at the end and the whole block takes half the memory of the dense one.
+    # With dtype float32 it is a quarter. Corrections are computed in float64 and rounded once when stored,
+    # still bench_covariance.py shows the association decisions of a float32 filter parting from the float64
+    # one two to three times sooner than plain float64 rounding differences do, and the map and pose follow
+    def __init__(self, cap, pose_cov, dtype=np.float64):
+        self.dtype = dtype
+        self.pp = np.array(pose_cov, dtype=float)
+        cap_lm = (cap - 3)//2
+        self.pl_buf = np.zeros((3, 2*cap_lm))
+        self.ll_buf = np.zeros(_slab_start(cap_lm), dtype=dtype)
+        self.resize(3)
+
+    def reserve(self, cap):
+        cap_lm = (cap - 3)//2
+        if 2*cap_lm <= self.pl_buf.shape[1]:
+            return
+        pl_buf = np.zeros((3, 2*cap_lm))
+        pl_buf[:, 0:self.n-3] = self.pl
+        ll_buf = np.zeros(_slab_start(cap_lm), dtype=self.dtype)
+        ll_buf[0:len(self.ll)] = self.ll
+        self.pl_buf, self.ll_buf = pl_buf, ll_buf
+        self.resize(self.n)
+
+    def resize(self, n):
+        self.n = n
+        self.N = (n - 3)//2
+        self.pl = self.pl_buf[:, 0:n-3]
+        self.ll = self.ll_buf[0:_slab_start(self.N)]
+
+    def slab(self, i):
+        # Rows of landmark i up to its diagonal block, a (2, 2(i+1)) view
+        return np.reshape(self.ll[_slab_start(i):_slab_start(i + 1)], (2, 2*(i + 1)))
+
+    def pose_block(self):
+        return self.pp
+
+    def cross(self):
+        return self.pl
+
+    def set_cross(self, M):
+        self.pl[...] = M
+
+    def add_landmark(self, G, L, C):
+        i = self.N - 1
+        self.pl[:, 2*i:2*i+2] = G
+        slab = self.slab(i)
+        slab[:, 0:2*i] = L
+        slab[:, 2*i:2*i+2] = C
+
+    def pose_rows(self, out):
+        rows = out[0:3, 0:self.n]
+        rows[:, 0:3] = self.pp
+        rows[:, 3:] = self.pl
+        return rows
+
+    def _upper_index(self, i):
+        # Flat positions in ll of the blocks right of landmark i's diagonal block (stored in the rows of the
+        # later landmarks), shaped like the (2, 2(N-i-1)) part of its rows they form
+        k = np.arange(i + 1, self.N)
+        idx = (_slab_start(k) + 2*i)[None, :, None] + np.arange(2)[:, None, None] \
+            + (2*(k + 1))[None, :, None]*np.arange(2)[None, None, :]
+        return np.reshape(idx, (2, -1))
+
+    def landmark_rows(self, i, out):
+        rows = out[0:2, 0:self.n]
+        rows[:, 0:3] = np.transpose(self.pl[:, 2*i:2*i+2])
+        rows[:, 3:5+2*i] = self.slab(i)
+        rows[:, 5+2*i:] = self.ll[self._upper_index(i)]
+        return rows
+
+    def blocks(self, idx):
+        Ppm = np.empty((len(idx), 3, 2))
+        Ppm[:, :, 0] = np.transpose(self.pl[:, 2*idx])
+        Ppm[:, :, 1] = np.transpose(self.pl[:, 2*idx+1])
+        diag = _slab_start(idx) + 2*idx
+        Pmm = np.empty((len(idx), 2, 2))
+        Pmm[:, 0, 0] = self.ll[diag]
+        Pmm[:, 0, 1] = self.ll[diag + 1]
+        Pmm[:, 1, 0] = self.ll[diag + 2*(idx + 1)]
+        Pmm[:, 1, 1] = self.ll[diag + 2*(idx + 1) + 1]
+        return self.pp, Ppm, Pmm
+
+    def rank_update(self, KT, HP, tmp):
+        # P -= K*(H*P), only computing the stored triangle. The landmark rows go UPDATE_BLOCK/2 landmarks
+        # at a time: the dense product for their rows up to the last diagonal block lands in tmp and its
+        # lower triangle part is subtracted from their (contiguous) slabs in one go
+        K0 = np.transpose(KT[:, 0:3])
+        self.pp -= np.matmul(K0, HP[:, 0:3])
+        self.pl -= np.matmul(K0, HP[:, 3:self.n])
+        step = UPDATE_BLOCK//2
+        for a in range(0, self.N, step):
+            b = min(a + step, self.N)
+            block = tmp[0:2*(b-a), 0:2*b]
+            np.matmul(np.transpose(KT[:, 3+2*a:3+2*b]), HP[:, 3:3+2*b], out=block)
+            lens = np.repeat(2*(np.arange(a, b) + 1), 2)
+            starts = np.cumsum(lens) - lens
+            rows = np.repeat(np.arange(2*(b-a)), lens)
+            cols = np.arange(np.sum(lens)) - np.repeat(starts, lens)
+            self.ll[_slab_start(a):_slab_start(b)] -= block[rows, cols]
+
+    def compact(self, keep):
+        keep_lm = (keep[3::2] - 3)//2
+        self.pl[:, 0:len(keep)-3] = self.pl[:, keep[3:]-3]
+        # Slabs only ever move towards the front, and each is gathered (copied) before it is written
+        for new, old in enumerate(keep_lm):
+            cols = np.ravel(2*keep_lm[0:new+1, None] + np.arange(2))
+            rows = self.slab(old)[:, cols]
+            self.ll[_slab_start(new):_slab_start(new + 1)] = np.ravel(rows)
+
+    def dense(self):
+        return packed_to_dense(self.pp, self.pl, self.ll)
+
+    def arrays(self):
+        return {'pp': self.pp, 'pl': self.pl, 'll': self.ll}
+
+    def restore(self, arrays):
+        if 'll' not in arrays:
+            P = dense_covariance(arrays)
+            self.pp[...] = P[0:3, 0:3]
+            self.pl[...] = P[0:3, 3:]
+            for i in range(self.N):
+                self.slab(i)[...] = P[3+2*i:5+2*i, 3:5+2*i]
+        else:
+            self.pp[...] = arrays['pp']
+            self.pl[...] = arrays['pl']
+            self.ll[...] = arrays['ll']
+
+    def nbytes(self):
+        return self.pp.nbytes + self.pl_buf.nbytes + self.ll_buf.nbytes
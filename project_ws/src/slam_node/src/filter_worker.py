@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Single consumer thread that owns the filter. ROS callbacks only push messages
+# onto a bounded queue, the worker applies them in arrival order. The odom handler
+# is given a list of messages: consecutive odometry messages waiting in the queue
+# are handed over together, so the filter can integrate each of their twists and
+# still take a single step for all of them.
+import time
+import threading
+import traceback
+from collections import deque
+import numpy as np
+
+
+class FilterWorker(threading.Thread):
+    def __init__(self, handlers, maxsize=64, drop_oldest_scan=True, coalesce_odom=True, on_error=None, on_idle=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.handlers = handlers                 # message kind -> function run on the worker thread
+        self.maxsize = maxsize
+        self.drop_oldest_scan = drop_oldest_scan # when full, make room by dropping the oldest landmark scan
+        self.coalesce_odom = coalesce_odom       # a new odometry message joins those still waiting at the tail
+        self.on_error = on_error                 # called with (kind, traceback text) when a handler raises
+        self.on_idle = on_idle                   # called when the queue runs empty, returns the seconds after
+                                                 # which to call it again if nothing comes in, or None
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.running = True
+        # Stats, guarded by cond
+        self.processed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.errors = 0                          # messages whose handler raised, the worker carries on
+        self.latencies = deque(maxlen=1000)      # arrival to end of processing, seconds
+
+    def push(self, kind, data):
+        # Called from callback threads, never blocks on the filter
+        with self.cond:
+            if self.coalesce_odom and kind == 'odom' and len(self.queue) > 0 and self.queue[-1][0] == 'odom':
+                # Takes no queue slot, and latency still counts from the first waiting message
+                self.queue[-1][1].append(data)
+                self.coalesced = self.coalesced + 1
+            else:
+                if len(self.queue) >= self.maxsize:
+                    self._make_room()
+                self.queue.append((kind, [data] if kind == 'odom' else data, time.time()))
+            self.max_depth = max(self.max_depth, len(self.queue))
+            self.cond.notify()
+
+    def _make_room(self):
+        if self.drop_oldest_scan:
+            for i in range(len(self.queue)):
+                if self.queue[i][0] == 'landmarks':
+                    del self.queue[i]
+                    self.dropped = self.dropped + 1
+                    return
+        self.queue.popleft()
+        self.dropped = self.dropped + 1
+
+    def run(self):
+        idle = None          # seconds on_idle wants to wait for, None to wait for the next message only
+        while True:
+            with self.cond:
+                if self.running and len(self.queue) == 0:
+                    self.cond.wait(idle)
+                if not self.running:
+                    return
+                item = self.queue.popleft() if len(self.queue) > 0 else None
+            if item is None:
+                # Ran empty, or on_idle's wait is over with nothing new
+                idle = self.on_idle()
+                continue
+            kind, data, arrival = item
+            idle = None if self.on_idle is None else 0
+            try:
+                self.handlers[kind](data)
+            except Exception:
+                # One bad message must not stop the filter for good
+                with self.cond:
+                    self.errors = self.errors + 1
+                if self.on_error is not None:
+                    self.on_error(kind, traceback.format_exc())
+            with self.cond:
+                self.processed = self.processed + 1
+                self.latencies.append(time.time() - arrival)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            lat = np.array(self.latencies)
+            stats = {'depth': len(self.queue), 'max_depth': self.max_depth, 'processed': self.processed,
+                     'dropped': self.dropped, 'coalesced': self.coalesced,
+                     'errors': self.errors}
+        if len(lat) > 0:
+            stats['latency_mean'] = lat.mean()
+            stats['latency_p95'] = np.percentile(lat, 95)
+            stats['latency_max'] = lat.max()
+        return stats
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Innovation covariance solves through a Cholesky factorization instead of an
+# explicit inverse. One factor of S serves the gain, the gating distance and the
+# log-likelihood. SciPy's LAPACK wrappers are used when available (they can
+# solve in place), otherwise NumPy. SciPy is only imported by the first
+# factorization, importing scipy.linalg takes longer than the rest of the core.
+import numpy as np
+
+LOG_2PI = np.log(2*np.pi)
+_linalg = None   # scipy.linalg once imported, False if there is no SciPy
+
+
+def _scipy_linalg():
+    global _linalg
+    if _linalg is None:
+        try:
+            import scipy.linalg
+            _linalg = scipy.linalg
+        except ImportError:
+            _linalg = False
+    return _linalg
+
+
+class Innovation():
+    # Factor of one innovation covariance S (m,m). If S is not positive definite (the covariance has
+    # lost definiteness) the solves fall back to LU so an update is never refused
+    def __init__(self, S):
+        self.S = S
+        self.dim = len(S)
+        self.factor = None
+        self.L = None
+        self.linalg = _scipy_linalg()
+        try:
+            if self.linalg:
+                self.factor = self.linalg.cho_factor(S, lower=True, check_finite=False)
+                self.L = np.tril(self.factor[0])
+            else:
+                self.L = np.linalg.cholesky(S)
+        except np.linalg.LinAlgError:
+            pass
+
+    def solve(self, B, overwrite=False):
+        # S^-1*B. With SciPy, overwrite=True and a Fortran ordered B the result is written into B
+        if self.factor is not None:
+            return self.linalg.cho_solve(self.factor, B, overwrite_b=overwrite, check_finite=False)
+        if self.L is not None:
+            return np.linalg.solve(np.transpose(self.L), np.linalg.solve(self.L, B))
+        return np.linalg.solve(self.S, B)
+
+    def whiten(self, err):
+        # L^-1*err, its squared norm is the mahalanobis distance
+        if self.factor is not None:
+            return self.linalg.solve_triangular(self.L, err, lower=True, check_finite=False)
+        return np.linalg.solve(self.L, err)
+
+    def mahalanobis(self, err):
+        if self.L is None:
+            return float(np.sum(err*np.linalg.solve(self.S, err)))
+        return float(np.sum(np.square(self.whiten(err))))
+
+    def log_det(self):
+        if self.L is None:
+            return np.linalg.slogdet(self.S)[1]
+        return 2*np.sum(np.log(np.diag(self.L)))
+
+    def log_likelihood(self, err):
+        # Log density of the innovation err under N(0, S)
+        return -0.5*(self.mahalanobis(err) + self.log_det() + self.dim*LOG_2PI)
+
+
+def batched_cholesky(S):
+    # Lower Cholesky factors of a stack of 1x1 or 2x2 matrices (N,k,k) in closed form, NaN where an S is
+    # not positive definite
+    L = np.zeros(S.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        L[:, 0, 0] = np.sqrt(S[:, 0, 0])
+        if S.shape[1] == 2:
+            L[:, 1, 0] = 0.5*(S[:, 1, 0] + S[:, 0, 1])/L[:, 0, 0]
+            L[:, 1, 1] = np.sqrt(S[:, 1, 1] - np.square(L[:, 1, 0]))
+    return L
+
+
+def batched_whiten(L, err):
+    # L_i^-1*err_i for every row of err (N,k) by forward substitution
+    w = np.empty(err.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w[:, 0] = err[:, 0]/L[:, 0, 0]
+        if err.shape[1] == 2:
+            w[:, 1] = (err[:, 1] - L[:, 1, 0]*w[:, 0])/L[:, 1, 1]
+    return w
+
+
+def batched_mahalanobis(L, err):
+    # err_i^T S_i^-1 err_i, infinite where S_i had no factor so such candidates never win a gate
+    d2 = np.sum(np.square(batched_whiten(L, err)), axis=1)
+    d2[np.logical_not(np.isfinite(d2))] = np.inf
+    return d2
+
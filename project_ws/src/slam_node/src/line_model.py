@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Line features in Hesse normal form: a line is (rho, phi) with rho >= 0 the
+# distance from the origin and phi the direction of its normal, so the point
+# on it closest to the origin is rho*(cos phi, sin phi). Unlike slope/intercept
+# this has no special cases for vertical or horizontal walls. Everything works
+# on whole arrays of lines at once.
+# Landmarks are stored by their world closest points. The filter observes a
+# wall as the (rho, phi) of its line in the robot frame, which predict_lines
+# models with its Jacobians.
+import numpy as np
+
+
+def wrap_angles(angles):
+    # Vectorized wrap_to_pi
+    return (angles + np.pi) % (2*np.pi) - np.pi
+
+
+def hesse_from_points(px, py, alpha):
+    # (rho, phi) of the lines through the points (px, py) with direction alpha
+    phi = np.asarray(alpha, dtype=float) + np.pi/2
+    rho = px*np.cos(phi) + py*np.sin(phi)
+    flip = rho < 0
+    rho = np.where(flip, -rho, rho)
+    phi = np.where(flip, phi - np.pi, phi)
+    return rho, wrap_angles(phi)
+
+
+def closest_points(rho, phi):
+    # Point of every line closest to the origin, shape (N,2)
+    return np.column_stack((rho*np.cos(phi), rho*np.sin(phi)))
+
+
+def segments_to_world(pose, lx, ly, alpha):
+    # Segment centres (N,2) and directions of robot frame segment observations in the world frame
+    c = np.cos(pose[2])
+    s = np.sin(pose[2])
+    centres = np.column_stack((pose[0] + c*lx - s*ly, pose[1] + s*lx + c*ly))
+    return centres, np.asarray(alpha, dtype=float) + pose[2]
+
+
+def _line_normals(points, alpha):
+    # Distances and unit normals (N,2) of lines given by their closest points. A line through the origin has
+    # no normal of its own, its direction alpha gives one. dn is the Jacobian (N,2,2) of the normal by the point
+    rho = np.sqrt(np.sum(np.square(points), axis=1))
+    phi = np.where(rho < 1e-9, np.asarray(alpha, dtype=float) + np.pi/2, np.arctan2(points[:, 1], points[:, 0]))
+    n = np.column_stack((np.cos(phi), np.sin(phi)))
+    dn = (np.eye(2) - n[:, :, None]*n[:, None, :])/np.maximum(rho, 1e-9)[:, None, None]
+    return rho, n, dn
+
+
+def predict_lines(pose, points, alpha=None):
+    # Robot frame (rho, phi) (N,2) of the lines given by their world closest points (N,2) and directions alpha,
+    # seen from pose, with the Jacobians by the pose (N,2,3) and by the points (N,2,2). rho is signed, so the
+    # model stays smooth for a wall running close to the robot: see align_observations. alpha is only needed
+    # for a line through the world origin
+    if alpha is None:
+        alpha = np.zeros(len(points))
+    rho, n, dn = _line_normals(points, alpha)
+    t = np.asarray(pose[0:2], dtype=float)
+    pred = np.column_stack((rho - np.matmul(n, t), wrap_angles(np.arctan2(n[:, 1], n[:, 0]) - pose[2])))
+    # rho_r = |p| - t.n and phi_r = phi - theta, with d|p|/dp = n and dphi/dp = n turned by pi/2 over |p|
+    Hx = np.zeros((len(rho), 2, 3))
+    Hx[:, 0, 0:2] = -n
+    Hx[:, 1, 2] = -1
+    Hm = np.empty((len(rho), 2, 2))
+    Hm[:, 0, :] = n - np.matmul(dn, t)
+    Hm[:, 1, :] = _perp(n)/np.maximum(rho, 1e-9)[:, None]
+    return pred, Hx, Hm
+
+
+def align_observations(z, pred):
+    # Observed lines z (N,2) or (1,2), rho >= 0 as hesse_from_points gives them, written with the normals of
+    # their predictions pred (N,2): the same line with its normal the other way round has rho negated and
+    # phi turned by pi
+    z = np.array(np.broadcast_to(z, np.shape(pred)), dtype=float)
+    flip = np.abs(wrap_angles(z[:, 1] - pred[:, 1])) > np.pi/2
+    z[flip, 0] = -z[flip, 0]
+    z[flip, 1] = wrap_angles(z[flip, 1] + np.pi)
+    return z
+
+
+def line_innovations(z, pred):
+    # z - pred for observations already aligned to their predictions, angles wrapped
+    err = z - pred
+    err[:, 1] = wrap_angles(err[:, 1])
+    return err
+
+
+def _rotation(theta):
+    return np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+
+
+def _perp(v):
+    # Every row of v (N,2) turned by +pi/2
+    return np.column_stack((-v[:, 1], v[:, 0]))
+
+
+def lines_to_frame(pose, points, alpha):
+    # Closest points (N,2) in the outer frame of lines given by their closest points in the frame at pose,
+    # with the Jacobians of the change of frame by the points (N,2,2) and by the pose (N,2,3)
+    rho, n, dn = _line_normals(points, alpha)
+    Rot = _rotation(pose[2])
+    t = np.asarray(pose[0:2], dtype=float)
+    n_w = np.matmul(n, np.transpose(Rot))
+    d = np.matmul(n_w, t)
+    # p_w = Rot*p + (t.n_w)*n_w, with n = p/|p| turning along with p
+    A = n_w[:, :, None]*t[None, None, :] + d[:, None, None]*np.eye(2)
+    J_points = Rot + np.matmul(np.matmul(A, Rot), dn)
+    J_pose = np.empty((len(rho), 2, 3))
+    J_pose[:, :, 0:2] = n_w[:, :, None]*n_w[:, None, :]
+    J_pose[:, :, 2] = (rho + d)[:, None]*_perp(n_w) + np.matmul(_perp(n_w), t)[:, None]*n_w
+    return (rho + d)[:, None]*n_w, J_points, J_pose
+
+
+def lines_into_frame(pose, points, alpha):
+    # The inverse of lines_to_frame: closest points (N,2) in the frame at pose of lines given by their closest
+    # points in the outer frame, with the Jacobians by the points (N,2,2) and by the pose (N,2,3)
+    rho, n, dn = _line_normals(points, alpha)
+    RotT = np.transpose(_rotation(pose[2]))
+    t = np.asarray(pose[0:2], dtype=float)
+    d = np.matmul(n, t)
+    m = np.matmul(n, np.transpose(RotT))
+    # p' = Rot^T*(p - (t.n)*n)
+    A = n[:, :, None]*t[None, None, :] + d[:, None, None]*np.eye(2)
+    J_points = np.matmul(RotT, np.eye(2) - np.matmul(A, dn))
+    J_pose = np.empty((len(rho), 2, 3))
+    J_pose[:, :, 0:2] = -np.matmul(RotT, n[:, :, None]*n[:, None, :])
+    J_pose[:, :, 2] = -(rho - d)[:, None]*_perp(m)
+    return (rho - d)[:, None]*m, J_points, J_pose
+
+
+def segment_union(a, b):
+    # [radius, angle, x, y] of the segment spanning the segments a and b, along the direction of a
+    radius, angle = a[0:2]
+    u = np.array([np.cos(angle), np.sin(angle)])
+    t_a = np.dot(a[2:4], u)
+    t_b = np.dot(b[2:4], u)
+    lo = min(t_a - radius, t_b - b[0])
+    hi = max(t_a + radius, t_b + b[0])
+    centre = a[2:4] + ((lo + hi)/2 - t_a)*u
+    return np.array([(hi - lo)/2, angle, centre[0], centre[1]])
+
+
+def observe_segments(pose, lx, ly, alpha):
+    # Everything landmark_update needs from a batch of segment observations: world frame centres (N,2),
+    # world directions (N,) and the points of the lines closest to the origin (N,2)
+    centres, alpha_w = segments_to_world(pose, lx, ly, alpha)
+    rho, phi = hesse_from_points(centres[:, 0], centres[:, 1], alpha_w)
+    return centres, alpha_w, closest_points(rho, phi)
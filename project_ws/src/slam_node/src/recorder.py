@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Compact binary log of the /odom and /landmarks streams and a reader that plays
+# it back deterministically through replay.Replay.
+#
+# A log is a directory of chunks. Every chunk holds fixed-width columnar records
+# saved as .npy files, so they can be memory mapped on read:
+#   odom_NNNNN.npy      seq, stamp, x, y, qw, vx, vy, wz per Odometry message
+#   lm_index_NNNNN.npy  seq, stamp, start, count per lm_array message
+#   lm_rows_NNNNN.npy   x, y, radius, angle, slope, intercept per landmark
+# seq is a global message counter, it restores the arrival order of the two
+# streams on playback.
+import os
+import glob
+import threading
+import numpy as np
+from replay import Landmark, LandmarkArray
+
+ODOM_DTYPE = np.dtype([('seq', '<u8'), ('stamp', '<f8'), ('x', '<f8'), ('y', '<f8'), ('qw', '<f8'),
+                       ('vx', '<f8'), ('vy', '<f8'), ('wz', '<f8')])
+LM_INDEX_DTYPE = np.dtype([('seq', '<u8'), ('stamp', '<f8'), ('start', '<u8'), ('count', '<u4')])
+LM_ROW_DTYPE = np.dtype([('x', '<f8'), ('y', '<f8'), ('radius', '<f8'), ('angle', '<f8'),
+                         ('slope', '<f8'), ('intercept', '<f8')])
+
+
+class LogRecorder():
+    # Appends messages to in-memory chunk buffers and writes a chunk out once it holds chunk_size messages.
+    # Safe to call from several callback threads
+    def __init__(self, path, chunk_size=4096):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.chunk = 0
+        self._new_chunk()
+
+    def _new_chunk(self):
+        self.odom = np.zeros(self.chunk_size, dtype=ODOM_DTYPE)
+        self.lm_index = np.zeros(self.chunk_size, dtype=LM_INDEX_DTYPE)
+        self.lm_rows = np.zeros(4*self.chunk_size, dtype=LM_ROW_DTYPE)
+        self.n_odom = 0
+        self.n_lm = 0
+        self.n_rows = 0
+
+    def record_odom(self, stamp, x, y, qw, vx, vy, wz):
+        with self.lock:
+            self.odom[self.n_odom] = (self.seq, stamp, x, y, qw, vx, vy, wz)
+            self.n_odom = self.n_odom + 1
+            self.seq = self.seq + 1
+            if self.n_odom == self.chunk_size:
+                self._write_chunk()
+
+    def record_landmarks(self, stamp, landmarks):
+        with self.lock:
+            count = len(landmarks)
+            if self.n_rows + count > len(self.lm_rows):
+                rows = np.zeros(max(2*len(self.lm_rows), self.n_rows + count), dtype=LM_ROW_DTYPE)
+                rows[0:self.n_rows] = self.lm_rows[0:self.n_rows]
+                self.lm_rows = rows
+            for i, lm in enumerate(landmarks):
+                self.lm_rows[self.n_rows + i] = (lm.x, lm.y, lm.radius, lm.angle, lm.slope, lm.intercept)
+            self.lm_index[self.n_lm] = (self.seq, stamp, self.n_rows, count)
+            self.n_rows = self.n_rows + count
+            self.n_lm = self.n_lm + 1
+            self.seq = self.seq + 1
+            if self.n_lm == self.chunk_size:
+                self._write_chunk()
+
+    def _write_chunk(self):
+        if self.n_odom == 0 and self.n_lm == 0:
+            return
+        name = '_%05d.npy' % self.chunk
+        np.save(os.path.join(self.path, 'odom' + name), self.odom[0:self.n_odom])
+        np.save(os.path.join(self.path, 'lm_index' + name), self.lm_index[0:self.n_lm])
+        np.save(os.path.join(self.path, 'lm_rows' + name), self.lm_rows[0:self.n_rows])
+        self.chunk = self.chunk + 1
+        self._new_chunk()
+
+    def flush(self):
+        with self.lock:
+            self._write_chunk()
+
+    def close(self):
+        self.flush()
+
+
+class LogReader():
+    # Plays a recorded log back as replay events, in the order the messages arrived
+    def __init__(self, path):
+        self.path = path
+        self.chunks = sorted(glob.glob(os.path.join(path, 'odom_*.npy')))
+
+    def _load(self, kind, chunk_file):
+        return np.load(chunk_file.replace('odom_', kind + '_'), mmap_mode='r')
+
+    def events(self):
+        for chunk_file in self.chunks:
+            odom = np.load(chunk_file, mmap_mode='r')
+            lm_index = self._load('lm_index', chunk_file)
+            lm_rows = self._load('lm_rows', chunk_file)
+            i = 0
+            j = 0
+            while i < len(odom) or j < len(lm_index):
+                if j >= len(lm_index) or (i < len(odom) and odom['seq'][i] < lm_index['seq'][j]):
+                    rec = odom[i]
+                    yield ('odom_msg', (rec['stamp'], rec['x'], rec['y'], rec['qw'], rec['vx'], rec['vy'], rec['wz']))
+                    i = i + 1
+                else:
+                    start = int(lm_index['start'][j])
+                    rows = lm_rows[start:start + int(lm_index['count'][j])]
+                    yield ('landmarks', LandmarkArray([Landmark(*[float(v) for v in row]) for row in rows]))
+                    j = j + 1
+
+    def summary(self):
+        n_odom = sum([len(np.load(f, mmap_mode='r')) for f in self.chunks])
+        n_lm = sum([len(self._load('lm_index', f)) for f in self.chunks])
+        return {'chunks': len(self.chunks), 'odom': n_odom, 'landmarks': n_lm}
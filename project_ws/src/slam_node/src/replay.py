@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Headless replay of recorded logs through the filter, as fast as the CPU allows.
+# Only needs NumPy: no rospy, Tk or matplotlib gets imported.
+# The log is either a data.csv style file or a directory written by recorder.LogRecorder.
+# Usage: python replay.py [log.csv|log_dir] [--out dir] [--verbose] [--profile] [--checkpoint dir]
+#                       [--covariance dense|packed] [--engine ekf|seif|submap]
+import os
+import sys
+import csv
+import time
+import argparse
+import numpy as np
+import slam_core
+from slam_core import make_filter
+
+
+class Landmark():
+    # Stand-in for slam_node/landmark with the fields landmark_update reads
+    def __init__(self, x, y, radius=0.0, angle=0.0, slope=0.0, intercept=0.0):
+        self.x = x
+        self.y = y
+        self.radius = radius
+        self.angle = angle
+        self.slope = slope
+        self.intercept = intercept
+
+
+class LandmarkArray():
+    # Stand-in for slam_node/lm_array
+    def __init__(self, landmarks):
+        self.landmarks = landmarks
+
+
+def load_csv_log(path):
+    # Events from a data.csv style log, one row per step with the columns
+    # ImFile, #, lastFwd, lastTurn, x, y, angle, Mx, My. lastTurn (degrees) is
+    # applied before lastFwd, x/y/angle is the true pose and Mx/My an optional
+    # point feature in the robot frame.
+    with open(path) as f:
+        rows = [row for row in csv.reader(f)][1:]
+    for i, row in enumerate(rows):
+        fwd, turn, real_x, real_y, real_t = [float(v) for v in row[2:7]]
+        if i == 0:
+            yield ('init', (real_x, real_y, real_t))
+        else:
+            yield ('motion', (fwd, np.radians(turn), real_x, real_y))
+        if len(row) > 8 and row[7].strip() and row[8].strip():
+            yield ('points', [(float(row[7]), float(row[8]))])
+
+
+def point_landmarks(slam, points):
+    # Point features as line landmarks: each line is perpendicular to the direction of its point from the
+    # world origin (under the current pose estimate), so the closest point the filter stores is the point itself
+    theta = slam.x[2,0]
+    c, s = np.cos(theta), np.sin(theta)
+    landmarks = []
+    for px, py in points:
+        wx = slam.x[0,0] + c*px - s*py
+        wy = slam.x[1,0] + s*px + c*py
+        landmarks.append(Landmark(px, py, 1.0, np.arctan2(wy, wx) + np.pi/2 - theta))
+    return LandmarkArray(landmarks)
+
+
+class Replay():
+    # Feeds events into a SLAM object and keeps the estimated and true trajectories.
+    # Events are (kind, data) with kind one of
+    #   init      (x, y, theta) initial pose
+    #   odom_msg  (stamp, x, y, qw, vx, vy, wz) fields of an Odometry message, handled like slam_node does
+    #   odom      (dx, dy, dt, real_x, real_y[, time_delta]) world frame increments, as slam_node computes them
+    #   motion    (fwd, turn, real_x, real_y) robot frame move, the turn is applied first
+    #   landmarks an lm_array (or LandmarkArray)
+    #   points    [(x, y), ...] point features in the robot frame
+    def __init__(self, slam):
+        self.slam = slam
+        self.trajectory = []
+        self.steps = 0
+
+    def run(self, events):
+        for kind, data in events:
+            self.step(kind, data)
+        return self
+
+    def step(self, kind, data):
+        slam = self.slam
+        self.steps = self.steps + 1
+        if kind == 'init':
+            slam.init_pose(*data)
+            slam.dX = 0
+            slam.dY = 0
+            slam.dT = 0
+            slam.poseInit = True
+            self.trajectory.append([data[0], data[1], data[2], data[0], data[1]])
+        elif kind == 'odom_msg':
+            slam.odom_message(*data)
+            self._record(data[1], data[2])
+        elif not slam.poseInit:
+            return
+        elif kind == 'odom':
+            slam.data['real_pose'] = np.array([[data[3]], [data[4]]])
+            if len(data) > 5:
+                slam.time_delta = data[5]
+            slam.odom_update(data[0], data[1], data[2])
+            self._record(data[3], data[4])
+        elif kind == 'motion':
+            fwd, turn, real_x, real_y = data
+            heading = slam.x[2,0] + turn
+            slam.data['real_pose'] = np.array([[real_x], [real_y]])
+            slam.odom_update(fwd*np.cos(heading), fwd*np.sin(heading), turn)
+            self._record(real_x, real_y)
+        elif kind == 'landmarks':
+            slam.landmark_update(data)
+        elif kind == 'points':
+            slam.landmark_update(point_landmarks(slam, data))
+        else:
+            raise ValueError('Unknown replay event ' + str(kind))
+
+    def _record(self, real_x, real_y):
+        x = self.slam.x
+        self.trajectory.append([x[0,0], x[1,0], x[2,0], real_x, real_y])
+
+    def save(self, out_dir):
+        # trajectory.csv: estimated pose and true position per odometry step
+        # landmarks.csv: landmark state and the line info it was created from
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        np.savetxt(os.path.join(out_dir, 'trajectory.csv'), np.array(self.trajectory).reshape(-1,5),
+                   delimiter=',', header='x,y,theta,real_x,real_y', comments='')
+        lm_pos = self.slam.x[3:,0].reshape(-1,2)
+        np.savetxt(os.path.join(out_dir, 'landmarks.csv'), np.hstack((lm_pos, self.slam.landmarks)).reshape(-1,6),
+                   delimiter=',', header='x,y,radius,angle,line_x,line_y', comments='')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded log through the SLAM filter without ROS or a GUI')
+    parser.add_argument('log', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'data.csv'))
+    parser.add_argument('--out', default='replay_out', help='directory for trajectory.csv and landmarks.csv')
+    parser.add_argument('--verbose', action='store_true', help='keep the filter debug output')
+    parser.add_argument('--profile', action='store_true', help='print per-stage filter timings')
+    parser.add_argument('--checkpoint', default='', help='write a checkpoint of the final filter state here (see checkpoint.py)')
+    parser.add_argument('--covariance', choices=['dense', 'packed'], default='dense', help='storage of the covariance')
+    parser.add_argument('--engine', choices=['ekf', 'seif', 'submap'], default='ekf',
+                        help='filter engine (see slam_core.make_filter)')
+    args = parser.parse_args()
+
+    slam_core.am_debugging = args.verbose
+    start = time.time()
+    if os.path.isdir(args.log):
+        from recorder import LogReader
+        events = LogReader(args.log).events()
+    else:
+        events = load_csv_log(args.log)
+    replay = Replay(make_filter(params={'profile': args.profile, 'engine': args.engine,
+                                          'covariance': args.covariance})).run(events)
+    elapsed = time.time() - start
+    replay.save(args.out)
+    if args.checkpoint:
+        import checkpoint
+        checkpoint.save(replay.slam, args.checkpoint)
+    print('Replayed %d events in %.3f s (%.0f events/s), %d landmarks, output in %s' % (
+        replay.steps, elapsed, replay.steps/max(elapsed, 1e-9), len(replay.slam.landmarks), args.out))
+    if args.profile:
+        print(replay.slam.timer.summary())
+        print('Memory (kB): ' + ', '.join(['%s %.0f' % (name, size/1e3) for name, size in sorted(replay.slam.memory_usage().items())]))
+
+
+if __name__ == '__main__':
+    main()
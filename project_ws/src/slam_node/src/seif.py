@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Sparse extended information filter (SEIF) engine, selected with the 'engine'
+# parameter (see slam_core.make_filter). It takes the same messages and keeps the
+# same landmark bookkeeping, association and map maintenance as the EKF, but
+# holds the gaussian in information form: the information matrix Omega as a
+# scipy.sparse matrix and the information vector xi. Only a bounded set of
+# active landmarks is linked to the pose. When more are linked, the oldest are
+# cut loose from it (sparsification). Odometry and landmark updates therefore
+# only touch the pose and the active landmarks, however large the map is. The
+# mean in x is kept up to date by a few relaxation sweeps over that
+# neighbourhood, and recovered exactly by a sparse solve every
+# seif_recover_every scans or on demand (recover_mean). The mahalanobis gate
+# (use_mahalanobis) takes its covariances from the same neighbourhood, see
+# InformationForm.blocks.
+import bisect
+import numpy as np
+import scipy.sparse
+from scipy.sparse.linalg import splu
+from association import landmark_positions
+from line_model import predict_lines
+from covariance import dense_covariance
+import slam_core
+from slam_core import SLAM, wrap_to_pi, debug_print
+
+LANDMARK_PRIOR = 1e-6   # Information a new landmark starts with, keeps Omega invertible for range only observations
+
+
+def _schur(A, idx):
+    # A[:,idx]*A[idx,idx]^-1*A[idx,:], the information removed by marginalizing the variables idx out of A
+    F = A[:, idx]
+    return np.matmul(F, np.linalg.solve(A[np.ix_(idx, idx)], np.transpose(F)))
+
+
+class InformationForm():
+    # Omega (n,n) and xi (n,) of the state [pose (3), landmark 0 (2), ...]. Omega is a LIL matrix: rows are cheap
+    # to read and a small block of entries cheap to change, and it converts to CSC for the sparse solves.
+    # Grows by reserve() / resize() like the covariance stores in covariance.py
+    def __init__(self, cap, pose_cov):
+        self.Omega = scipy.sparse.lil_matrix((3, 3))
+        self.Omega[0:3, 0:3] = np.linalg.inv(pose_cov)
+        self._xi_buf = np.zeros(cap)
+        self._lu = None
+        self.n = 3
+        self.resize(3)
+
+    def reserve(self, cap):
+        if cap <= len(self._xi_buf):
+            return
+        xi_buf = np.zeros(cap)
+        xi_buf[0:self.n] = self.xi
+        self._xi_buf = xi_buf
+        self.resize(self.n)
+
+    def resize(self, n):
+        if self.Omega.shape[0] != n:
+            self.Omega.resize((n, n))
+            self._xi_buf[self.n:n] = 0
+        self.n = n
+        self.xi = self._xi_buf[0:n]
+        self._lu = None
+
+    def _row(self, i):
+        # Column indices and values of row i, straight from the LIL lists (indexing Omega costs far more)
+        return np.array(self.Omega.rows[i], dtype=int), np.array(self.Omega.data[i])
+
+    def _set_row(self, i, cols, vals):
+        # Row i from column indices and values, repeated columns are summed and zeros dropped from the structure
+        cols, inv = np.unique(cols, return_inverse=True)
+        vals = np.bincount(inv, weights=vals, minlength=len(cols))
+        keep = vals != 0
+        self.Omega.rows[i] = cols[keep].tolist()
+        self.Omega.data[i] = vals[keep].tolist()
+
+    def block(self, S):
+        # Omega[S,S] as a dense array, S sorted
+        B = np.zeros((len(S), len(S)))
+        for k, i in enumerate(S):
+            cols, vals = self._row(i)
+            pos = np.minimum(np.searchsorted(S, cols), len(S) - 1)
+            inside = S[pos] == cols
+            B[k, pos[inside]] = vals[inside]
+        return B
+
+    def relax(self, r, mu):
+        # Gauss-Seidel step for the contiguous variables r: mu[r] += Omega[r,r]^-1*(xi[r] - Omega[r,:]*mu)
+        resid = self.xi[r].copy()
+        B = np.zeros((len(r), len(r)))
+        for k, i in enumerate(r):
+            cols, vals = self._row(i)
+            resid[k] -= np.dot(vals, mu[cols])
+            inside = (cols >= r[0]) & (cols <= r[-1])
+            B[k, cols[inside] - r[0]] = vals[inside]
+        mu[r] += np.linalg.solve(B, resid)
+
+    def add(self, S, D):
+        # Omega[S,S] += D, entries that come out exactly zero are dropped from the structure
+        for k, i in enumerate(S):
+            cols, vals = self._row(i)
+            nz = D[k] != 0
+            self._set_row(i, np.concatenate((cols, S[nz])), np.concatenate((vals, D[k][nz])))
+        self._lu = None
+
+    def neighbours(self, rows):
+        # State indices linked to any of rows (including rows themselves if they have information)
+        cols = [self.Omega.rows[r] for r in rows]
+        return np.unique(np.concatenate(cols)).astype(int) if cols else np.zeros(0, dtype=int)
+
+    def pose_links(self):
+        # Indices of the landmarks linked to the pose, the active landmarks
+        cols = self.neighbours(range(3))
+        return np.unique((cols[cols >= 3] - 3)//2)
+
+    def _factor(self):
+        if self._lu is None:
+            self._lu = splu(self.Omega.tocsc())
+        return self._lu
+
+    def mean(self):
+        return self._factor().solve(self.xi)
+
+    def blocks(self, idx):
+        # Covariance blocks for the mahalanobis gate, see association.covariance_blocks. The exact marginals take
+        # a factorization of the whole of Omega, so they come from the neighbourhood instead: the covariance of
+        # the pose, the active landmarks and the landmarks idx conditioned on the rest of the map, the inverse of
+        # Omega over them. Conditioning only ever shrinks it, by the correlations through the rest of the map,
+        # so the gate comes out slightly stricter than with the marginals
+        lm = np.union1d(self.pose_links(), idx)
+        C = np.linalg.inv(self.block(np.concatenate((np.arange(3), (3 + 2*lm[:,None] + np.arange(2)).ravel()))))
+        J = 3 + 2*np.searchsorted(lm, idx)[:,None] + np.arange(2)      # Rows of every landmark of idx in C
+        Ppm = np.transpose(C[0:3][:,J], (1, 0, 2))
+        Pmm = C[J[:,:,None], J[:,None,:]]
+        return C[0:3, 0:3], Ppm, Pmm
+
+    def _add_entry(self, i, j, v):
+        # Omega[i,j] += v in place in the LIL lists, an entry that comes out exactly zero is dropped
+        row = self.Omega.rows[i]
+        data = self.Omega.data[i]
+        k = bisect.bisect_left(row, j)
+        if k < len(row) and row[k] == j:
+            data[k] += v
+            if data[k] == 0:
+                del row[k]
+                del data[k]
+        elif v != 0:
+            row.insert(k, j)
+            data.insert(k, v)
+
+    def fold(self, a, b):
+        # Substitute the variables b:b+2 by a:a+2 (a hard m_a = m_b constraint): their rows and columns are added
+        # to a's and cleared. Besides the rows of a and b, only the neighbours of b change, each by the two or
+        # four entries in columns b:b+2 moving over to a:a+2
+        nb = np.setdiff1d(self.neighbours([b, b+1]), [a, a+1, b, b+1])
+        for i in (a, a+1):
+            cols, vals = self._row(i)
+            cols_b, vals_b = self._row(i + b - a)
+            cols = np.concatenate((cols, cols_b))
+            self._set_row(i, np.where((cols == b) | (cols == b+1), cols + a - b, cols), np.concatenate((vals, vals_b)))
+        for i in (b, b+1):
+            self.Omega.rows[i] = []
+            self.Omega.data[i] = []
+        for i in nb:
+            row = self.Omega.rows[i]
+            data = self.Omega.data[i]
+            k = bisect.bisect_left(row, b)
+            m = bisect.bisect_right(row, b+1, k)
+            moved = list(zip(row[k:m], data[k:m]))
+            del row[k:m]
+            del data[k:m]
+            for j, v in moved:
+                self._add_entry(i, j + a - b, v)
+        self.xi[a:a+2] += self.xi[b:b+2]
+        self.xi[b:b+2] = 0
+        self._lu = None
+
+    def compact(self, keep):
+        # Marginalize out the state entries not in keep (by the Schur complement, which only fills in among their
+        # neighbours) and drop them, resize must follow. Entries cleared by fold carry no information and are
+        # just dropped. All of it works on one CSR copy converted back once: indexing a LIL matrix by rows and
+        # columns goes entry by entry in Python
+        Omega = self.Omega.tocsr()
+        drop = np.setdiff1d(np.arange(self.n), keep)
+        drop = drop[Omega.diagonal()[drop] != 0]
+        if len(drop) > 0:
+            nb = np.setdiff1d(self.neighbours(drop), drop)
+            if len(nb) > 0:
+                Od = Omega[drop]
+                Odn = Od[:, nb].toarray()
+                X = np.linalg.solve(Od[:, drop].toarray(), Odn)   # Omega_dd^-1*Omega_dn
+                D = -np.matmul(np.transpose(Odn), X)
+                Omega = Omega + scipy.sparse.csr_matrix((D.ravel(), (np.repeat(nb, len(nb)), np.tile(nb, len(nb)))),
+                                                        shape=Omega.shape)
+                Omega.eliminate_zeros()
+                self.xi[nb] -= np.matmul(np.transpose(X), self.xi[drop])
+        self.Omega = Omega[keep][:, keep].tolil()
+        self.xi[0:len(keep)] = self.xi[keep]
+        self._lu = None
+
+    def dense(self):
+        # The covariance, inverting the whole of Omega
+        return np.linalg.inv(self.Omega.toarray())
+
+    def arrays(self):
+        Omega = self.Omega.tocsr()
+        return {'Omega_data': Omega.data, 'Omega_indices': Omega.indices, 'Omega_indptr': Omega.indptr, 'xi': self.xi}
+
+    def restore(self, arrays):
+        if 'xi' in arrays:
+            self.Omega = scipy.sparse.csr_matrix((arrays['Omega_data'], arrays['Omega_indices'], arrays['Omega_indptr']),
+                                                 shape=(self.n, self.n)).tolil()
+            self.xi[...] = arrays['xi']
+        else:
+            # From a covariance checkpoint, Omega comes out dense and only the pose links get sparsified later
+            self.Omega = scipy.sparse.lil_matrix(np.linalg.inv(dense_covariance(arrays)))
+            self.xi[...] = self.Omega.tocsr().dot(arrays['x'][:, 0])
+        self._lu = None
+
+    def nbytes(self):
+        # What it takes as CSR: a value and a column index per stored entry, plus the row pointers and xi
+        return 12*self.Omega.nnz + 4*(self.n + 1) + self._xi_buf.nbytes
+
+
+class SEIF(SLAM):
+    ENGINE = 'seif'
+
+    def __init__(self, q=None, params=None):
+        # _Q_acc: process noise accumulated with _Phi_acc, not yet in Omega. _pose_flushed: pose mean Omega and xi
+        # agree with, pending odometry moves x away from it. Both are set by _odometry_flushed
+        SLAM.__init__(self, q, params)
+        self.recovered = 0                           # Full mean recoveries so far
+
+    def _make_store(self, cap, params):
+        return InformationForm(cap, np.diag(params['P0']))
+
+    def init_pose(self, x, y, theta):
+        SLAM.init_pose(self, x, y, theta)
+        self.cov.xi[0:3] = self.cov.Omega[0:3].tocsr().dot(self.x[:,0])
+        self._wrap_heading()
+
+    def _predict(self, Phi, Q):
+        # The pose only ever moves by itself, so any number of odometry steps amount to one G = Phi_n*..*Phi_1
+        # and one process noise Q_acc on the pose. Accumulate both and apply them once per scan
+        self._Phi_acc = np.matmul(Phi,self._Phi_acc)
+        self._Q_acc = np.matmul(np.matmul(Phi,self._Q_acc),np.transpose(Phi)) + Q
+        self._odom_pending = True
+
+    def flush_odometry(self):
+        # Information form of P = G*P*G^T + Q_acc: with Phi = G^-T*Omega*G^-1 (only the pose rows change),
+        # Omega = Phi - Phi*Fx^T*(I + Q*Phi_pp)^-1*Q*Fx*Phi. Both terms only involve the pose and the
+        # landmarks linked to it, and xi follows from xi = Omega*mu
+        if not self._odom_pending:
+            return
+        act = self.cov.pose_links()
+        S = np.concatenate((np.arange(3), (3 + 2*act[:,None] + np.arange(2)).ravel()))
+        A = self.cov.block(S)
+        T = np.eye(len(S))
+        T[0:3,0:3] = np.linalg.inv(self._Phi_acc)
+        Phi = np.matmul(np.matmul(np.transpose(T),A),T)
+        Fp = Phi[:,0:3]
+        kappa = np.matmul(Fp,np.linalg.solve(np.eye(3) + np.matmul(self._Q_acc,Phi[0:3,0:3]), np.matmul(self._Q_acc,np.transpose(Fp))))
+        Omega = Phi - kappa
+        Omega = 0.5*(Omega + np.transpose(Omega))
+        D = Omega - A
+        mu = self.x[S,0].copy()
+        mu[0:3] = self._pose_flushed
+        self.cov.xi[S] += np.matmul(D,mu) + np.matmul(Omega[:,0:3],self.x[0:3,0] - self._pose_flushed)
+        self.cov.add(S, D)
+        self._odometry_flushed()
+
+    def _odometry_flushed(self):
+        SLAM._odometry_flushed(self)
+        self._Q_acc = np.zeros((3,3))
+        self._pose_flushed = self.x[0:3,0].copy()
+
+    def _init_landmark(self, R):
+        # The landmark starts with no information beyond a tiny prior and gets that of the observation it was
+        # made from, which has no innovation since x already holds the observed point
+        n = len(self.x) - 2
+        S = np.array([0, 1, 2, n, n+1])
+        rows = 1 if slam_core.no_bearing else 2
+        pred, Hx, Hm = predict_lines(self.x[0:3,0], self.x[n:n+2,0].reshape(1,2), self.landmarks[-1:,1])
+        H = np.hstack((Hx[0,0:rows], Hm[0,0:rows]))
+        info = np.matmul(np.transpose(H),np.linalg.solve(np.atleast_2d(R),H))
+        info[3:5,3:5] += LANDMARK_PRIOR*np.eye(2)
+        self.cov.add(S, info)
+        self.cov.xi[S] += np.matmul(info,self.x[S,0])
+
+    def landmark_update(self, data):
+        SLAM.landmark_update(self, data)
+        t0 = self.timer.start()
+        self._sparsify()
+        self.timer.stop('sparsify', t0)
+        if self.seif_recover_every > 0 and self.scan % self.seif_recover_every == 0:
+            self.recover_mean()
+        else:
+            t0 = self.timer.start()
+            self._relax(self.cov.pose_links())
+            self.grid.update(landmark_positions(self.x))
+            self.timer.stop('relax', t0)
+
+    def stacked_update(self, obs):
+        # Information filter correction: Omega += H^T*R^-1*H and xi += H^T*R^-1*(err + H*mu), both only touching
+        # the pose and the observed landmarks. The innovation likelihood would need the covariance, so
+        # log_likelihood is not tracked by this engine
+        t0 = self.timer.start()
+        inds = np.unique([o[1] for o in obs])
+        S = np.concatenate((np.arange(3), (3 + 2*inds[:,None] + np.arange(2)).ravel()))
+        D = np.zeros((len(S),len(S)))
+        for Hx, ind, Hm, e, R in obs:
+            cols = np.concatenate((np.arange(3), 3 + 2*np.searchsorted(inds, ind) + np.arange(2)))
+            H = np.hstack((Hx, Hm))
+            HtRi = np.transpose(np.linalg.solve(R, H))             # H^T*R^-1 (R is symmetric)
+            D[np.ix_(cols,cols)] += np.matmul(HtRi,H)
+            self.cov.xi[S[cols]] += np.matmul(HtRi,e + np.matmul(H,self.x[S[cols]]))[:,0]
+        self.cov.add(S, D)
+        self.timer.stop('gain', t0)
+        t0 = self.timer.start()
+        self._relax(np.union1d(inds, self.cov.pose_links()))
+        self.grid.update(landmark_positions(self.x))
+        self.timer.stop('cov_update', t0)
+
+    def _relax(self, lms):
+        # Block Gauss-Seidel on Omega*mu = xi over the pose and the landmarks lms, seif_relax sweeps. Every block
+        # only reads its own row of Omega, so this costs the size of their neighbourhood rather than of the map
+        blocks = [np.arange(3)] + [3 + 2*i + np.arange(2) for i in lms]
+        for sweep in range(self.seif_relax):
+            for r in blocks:
+                self.cov.relax(r, self.x[:,0])
+        self._wrap_heading()
+
+    def _wrap_heading(self):
+        # After the mean changed with no odometry pending: keep the heading in [-pi, pi] (shifting the mean by
+        # 2*pi keeps Omega and needs xi += Omega[:,2]*shift) and remember the pose odometry starts from
+        wrapped = wrap_to_pi(self.x[2,0])
+        if wrapped != self.x[2,0]:
+            shift = wrapped - self.x[2,0]
+            self.x[2,0] = wrapped
+            col = self.cov.Omega[:,2].tocsc()
+            self.cov.xi[col.indices] += shift*col.data
+        self._pose_flushed = self.x[0:3,0].copy()
+
+    def recover_mean(self):
+        # Exact mean mu = Omega^-1*xi by a sparse factorization of Omega
+        t0 = self.timer.start()
+        self.flush_odometry()
+        self.x[:,0] = self.cov.mean()
+        self._wrap_heading()
+        self.grid.update(landmark_positions(self.x))
+        self.recovered = self.recovered + 1
+        self.timer.stop('recover', t0)
+        debug_print('Recovered the mean of %d landmarks', len(self.landmarks))
+
+    def _sparsify(self):
+        # Cut the pose links of the active landmarks observed longest ago until at most seif_active are left
+        # (landmarks of the current scan are never cut). With S = pose + active landmarks and m0 the ones to cut
+        # (Thrun et al., Probabilistic Robotics, table 12.3):
+        #   Omega_S += -schur(m0) + schur(pose, m0) - schur(pose)
+        # which leaves the pose and m0 conditionally independent, and xi_S += (change of Omega_S)*mu_S
+        self.flush_odometry()
+        act = self.cov.pose_links()
+        if len(act) <= self.seif_active:
+            return
+        order = act[np.argsort(-self.lm_obs[act,1], kind='stable')]
+        cut = order[self.seif_active:]
+        cut = cut[self.lm_obs[cut,1] < self.scan]
+        if len(cut) == 0:
+            return
+        S = np.concatenate((np.arange(3), (3 + 2*act[:,None] + np.arange(2)).ravel()))
+        pose = np.arange(3)
+        m0 = np.nonzero(np.isin((S - 3)//2, cut) & (S >= 3))[0]
+        A = self.cov.block(S)
+        Omega = A - _schur(A, m0) + _schur(A, np.concatenate((pose, m0))) - _schur(A, pose)
+        Omega[np.ix_(pose, m0)] = 0
+        Omega[np.ix_(m0, pose)] = 0
+        Omega = 0.5*(Omega + np.transpose(Omega))
+        D = Omega - A
+        self.cov.xi[S] += np.matmul(D,self.x[S,0])
+        self.cov.add(S, D)
+
+    def _fuse_state(self, i, j):
+        # Substitute landmark j by i instead of a pseudo observation, which would be an ill conditioned huge
+        # information entry here
+        self.cov.fold(3+2*i, 3+2*j)
+        self._relax([i])
@@ -0,0 +1,521 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# The EKF itself. Only needs NumPy, so it can be used without ROS or a display
+# (see replay.py), pyslam.py wraps it in the ROS node and the GUI.
+import warnings
+import numpy as np
+from association import associate, landmark_positions
+from line_model import observe_segments, segment_union, hesse_from_points, predict_lines, align_observations, line_innovations
+from spatial_index import LandmarkGrid
+from stage_timer import StageTimer
+from innovation import Innovation
+from covariance import DenseCovariance, PackedCovariance, UPDATE_BLOCK
+
+am_debugging = False    # Print the filter internals at every step, replay --verbose and slam_node ~debug turn it on
+no_bearing = False
+
+def debug_print(fmt, *args):
+    # Formatting is left until we know the message is printed, the arguments are often whole state arrays
+    if am_debugging:
+        print(fmt % args if args else fmt)
+
+def wrap_to_pi(angle):
+    if angle > np.pi:
+        return (angle-2*np.pi)
+    elif angle < -np.pi:
+        return (angle+2*np.pi)
+    return angle
+
+# Tuning parameters, SLAM(params=...) overrides any of them
+DEFAULT_PARAMS = {
+    'r_t': 0.25,               # Threshold for assosciation
+    'use_mahalanobis': False,  # Gate on mahalanobis distance instead of point residual
+    'm_t': 5.99,               # Mahalanobis threshold (chi-squared, 2 dof, 95%)
+    'gate_radius': 2.0,        # Only landmarks this close to an observation are considered
+    'batch_update': True,      # Apply all matches of a landmark message as one stacked update
+    'preintegrate': True,      # Defer odometry's effect on the landmark cross covariances
+    'v_r': 3.0,                # Measurement error ratio
+    'v_b': 0.45,
+    'C': 1.65,                 # Process noise intensity val
+    'P0': [0.1, 0.1, np.pi/4], # Diagonal of the initial pose covariance
+    'profile': False,          # Collect per-stage timings (see stage_stats)
+    'confirm_count': 2,        # Observations after which a landmark is confirmed and never pruned
+    'prune_age': 20,           # Scans a tentative landmark may go unobserved before it is removed (0 keeps all)
+    'prune_every': 10,         # Scans between compactions of the state
+    'merge_every': 10,         # Scans between passes fusing duplicate landmarks (0 never fuses)
+    'merge_radius': 0.2,       # Landmarks of one line have closest points at most this far apart
+    'merge_angle': 0.1,        # and directions at most this far apart (rad)
+    'covariance': 'dense',     # Storage of P: 'dense' matrix or 'packed' lower triangle (see covariance.py)
+    'cov_float32': False,      # Keep the landmark/landmark part of a packed P in float32 (experimental, see covariance.py)
+    'engine': 'ekf',           # Filter engine: 'ekf' (this file), 'seif' (seif.py) or 'submap' (submap.py)
+    'seif_active': 10,         # SEIF: landmarks linked to the pose at most, the rest get sparsified away
+    'seif_relax': 2,           # SEIF: Gauss-Seidel sweeps over the active landmarks per scan to update the mean
+    'seif_recover_every': 20,  # SEIF: scans between full mean recoveries by sparse solve (0 only on demand)
+    'submap_landmarks': 80,    # Submaps: landmarks in the active submap before the next one is started
+    'submap_distance': 20.0,   # Submaps: distance travelled (m) in the active submap before the next one (0 never)
+    'submap_background': True, # Submaps: merge finished submaps into the global map on a background thread
+    'submap_seed_range': 5.0,  # Submaps: confirmed landmarks this close (m) to the robot carry over into the next submap
+}
+
+# The values simple_slam uses
+SIMPLE_SLAM_PARAMS = dict(DEFAULT_PARAMS, r_t=0.2, v_r=0.05, v_b=0.005, C=5, P0=[0.1, 0.1, 0.01])
+
+def make_filter(q=None, params=None):
+    # The filter engine selected by the 'engine' parameter. Every engine takes the same odometry and landmark
+    # messages and exposes the same state (x, landmarks, lm_obs, data), so they are interchangeable
+    engine = dict(DEFAULT_PARAMS, **(params or {}))['engine']
+    if engine == 'seif':
+        from seif import SEIF
+        return SEIF(q, params)
+    if engine == 'submap':
+        from submap import SubmapSLAM
+        return SubmapSLAM(q, params)
+    return SLAM(q, params)
+
+def apply_params(filt, params):
+    # Fill in the defaults, check the parameters and set the tuning ones as attributes of the filter.
+    # Returns the full set, which the filter keeps as filt.params
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    unknown = set(params) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError('Unknown SLAM parameters: ' + ', '.join(sorted(unknown)))
+    for name, value in params.items():
+        if name not in ('P0', 'profile', 'covariance', 'cov_float32'):
+            setattr(filt, name, value)
+    if filt.engine != filt.ENGINE:
+        raise ValueError('%s is the %s engine, use make_filter for %s' % (type(filt).__name__, filt.ENGINE, filt.engine))
+    filt.params = params
+    return params
+
+class SLAM():
+    ENGINE = 'ekf'
+
+    def __init__(self, q=None, params=None):
+        # Initialized state vector, covariance, etc 
+        self.poseInit = False 
+        params = apply_params(self, params)
+        self.timer = StageTimer(params['profile'])
+        # State, covariance and landmark info live in preallocated buffers that double in size when full,
+        # self.x and self.landmarks are views onto the active part of them
+        self._x_buf = np.zeros((3+2*16,1))
+        self.cov = self._make_store(3+2*16, params)                            # Covariance matrix
+        self._lm_buf = np.zeros((16,4))                                       # radius, angle, x, y
+        self._obs_buf = np.zeros((16,2), dtype=int)                           # times observed, last scan seen
+        self._set_size(3)
+        self.grid = LandmarkGrid(self.gate_radius)   # Spatial index over landmark positions
+        self._odometry_flushed()
+        # Scratch space for stacked_update, grown with the buffers so updates allocate nothing n sized
+        self._ws_HP = np.empty((0,0))
+        self._ws_KT = np.empty(0)
+        self._ws_tmp = np.empty((0,0))
+        self._ws_dx = np.empty((1,0))
+        self._ws_rows = np.empty((5,0))
+        self.scan = 0                                # Number of landmark messages processed
+        self.pruned = 0                              # Landmarks removed by prune_landmarks so far
+        self.merged = 0                              # Landmarks fused into another by merge_duplicates so far
+        self.log_likelihood = 0.0                    # Sum of the innovation log-likelihoods of all corrections
+
+        # Process noise intensity matrix 
+        # self.Gamma = np.array([[0.05, 0.005],
+        #     [0.05, 0.005],
+        #     [  0, 0.001]])
+        self.dX = None
+        self.dY = None
+        self.dT = None
+        self.q = q
+        self.time_delta = 0
+        self.t1 = None                               # stamp of the last odometry message
+        self.data = {}
+        self.data['lm_info'] = None
+
+    def _make_store(self, cap, params):
+        # Storage of the gaussian's spread for a state capacity of cap, see covariance.py
+        if params['covariance'] == 'packed':
+            if params['cov_float32']:
+                warnings.warn('cov_float32 makes the filter drift from the float64 one within tens of scans, '
+                              'see bench_covariance.py')
+            return PackedCovariance(cap, np.diag(params['P0']), np.float32 if params['cov_float32'] else np.float64)
+        elif params['covariance'] == 'dense':
+            return DenseCovariance(cap, np.diag(params['P0']))
+        raise ValueError('Unknown covariance storage ' + str(params['covariance']))
+
+    def _set_size(self, n):
+        # Point the state views at the first n entries of the backing buffers
+        self.x = self._x_buf[0:n]
+        self.cov.resize(n)
+        self.landmarks = self._lm_buf[0:int((n-3)/2)]
+        self.lm_obs = self._obs_buf[0:int((n-3)/2)]
+
+    def _reserve(self, n):
+        # Make room for a state of size n, doubling the buffers so growth is amortized O(1) copies per entry
+        cap = len(self._x_buf)
+        if n <= cap:
+            return
+        new_cap = max(n, 3+2*(cap-3))
+        cur = len(self.x)
+        x_buf = np.zeros((new_cap,1))
+        x_buf[0:cur] = self.x
+        self.cov.reserve(new_cap)
+        lm_buf = np.zeros((int((new_cap-3)/2),4))
+        lm_buf[0:len(self.landmarks)] = self.landmarks
+        obs_buf = np.zeros((int((new_cap-3)/2),2), dtype=int)
+        obs_buf[0:len(self.lm_obs)] = self.lm_obs
+        self._x_buf, self._lm_buf, self._obs_buf = x_buf, lm_buf, obs_buf
+        self._set_size(cur)
+
+    @property
+    def P(self):
+        # The covariance as a dense matrix, a view for dense storage and a copy for packed storage
+        return self.cov.dense()
+
+    def memory_usage(self):
+        # Bytes held by the covariance, the other state buffers and the update scratch space
+        return {'covariance': self.cov.nbytes(),
+                'state': self._x_buf.nbytes + self._lm_buf.nbytes + self._obs_buf.nbytes,
+                'workspace': self._ws_HP.nbytes + self._ws_KT.nbytes + self._ws_tmp.nbytes + self._ws_dx.nbytes + self._ws_rows.nbytes}
+
+    def init_pose(self, x, y, theta):
+        self.x[0:3,0] = [x, y, theta]
+
+    def odom_message(self, stamp, x, y, qw, vx, vy, wz):
+        # Fields of an Odometry message: the first one initializes the pose, after that the twist is
+        # integrated over the time since the previous message. With the pose known but no previous stamp (a
+        # live resume from a checkpoint) the message only sets the stamp to integrate from
+        self.data['real_pose'] = np.array([[x],[y]])
+        if not self.poseInit:
+            self.init_pose(x, y, 2 * np.arccos(qw))
+            self.dX = 0
+            self.dY = 0
+            self.dT = 0
+            self.poseInit = True
+        elif self.t1 is not None:
+            self.time_delta = stamp - self.t1
+            self.odom_update(self.time_delta*vx, self.time_delta*vy, self.time_delta*wz)
+        self.t1 = stamp
+
+    def odom_messages(self, msgs):
+        # A run of odometry messages (stamp, x, y, qw, vx, vy, wz) handled as one step, as the filter worker
+        # hands them over when it falls behind. Each twist is integrated over its own interval and the summed
+        # motion goes through a single odom_update, whose process noise is that of the summed motion
+        self.odom_message(*msgs[0])
+        if len(msgs) == 1:
+            return
+        stamps = np.array([m[0] for m in msgs])
+        twists = np.array([m[4:7] for m in msgs[1:]])
+        self.data['real_pose'] = np.array([[msgs[-1][1]],[msgs[-1][2]]])
+        self.time_delta = stamps[-1] - stamps[0]
+        dx, dy, dt = np.matmul(np.diff(stamps), twists)
+        self.odom_update(dx, dy, dt)
+        self.t1 = stamps[-1]
+
+    def odom_update(self,dx,dy,dt):
+        debug_print('Running odometry update (x,y,t): (%s,%s,%s)', self.x[0,0], self.x[1,0], self.x[2,0])
+        t0 = self.timer.start()
+        self.dT = dt
+        self.dX = dx
+        self.dY = dy
+        # Calculate priors for pose and covariance
+        xP = np.array([[self.x[0,0] + self.dX],
+            [self.x[1,0] + self.dY],
+            [self.x[2,0] + self.dT]])
+        xP[2,0] = wrap_to_pi(xP[2,0])
+        self.x[0:3] = np.array([[self.x[0,0] + self.dX],
+            [self.x[1,0] + self.dY],
+            [self.x[2,0] + self.dT]])
+        self.x[2,0] = wrap_to_pi(self.x[2,0])
+
+        Phi = np.array([[1, 0, -self.dY],
+            [0, 1, self.dX],
+            [0, 0, 1]])
+
+        # r1 = np.matmul(np.matmul(self.Gamma,np.identity(2)), np.transpose(self.Gamma)) # Gamma*Q*Gamma^T
+        W = np.array([[self.dX],[self.dY],[self.dT]])
+        Q = np.matmul(W*self.C,np.transpose(W))
+        self._predict(Phi, Q)
+        self.timer.stop('odom', t0)
+        self.data['state'] = self.x
+        if self.q is not None:
+            t0 = self.timer.start()
+            self.q.put(self.data)
+            self.timer.stop('publish', t0)
+
+    def _predict(self, Phi, Q):
+        # Covariance part of the odometry update, x has already moved: P = G*P*G^T + Q with G = Phi on the pose
+        Ppp = self.cov.pose_block()
+        r2 = np.matmul(np.matmul(Phi,Ppp), np.transpose(Phi))         # Phi*P*Phi^T
+        Ppp[...] = r2 + Q
+
+        if self.preintegrate:
+            # Process noise only touches the pose block, so the landmark cross terms just need the product of
+            # the Phis. Accumulate it and apply it once when something reads them (see flush_odometry)
+            self._Phi_acc = np.matmul(Phi,self._Phi_acc)
+            self._odom_pending = True
+        elif len(self.x) > 3:
+            self.cov.set_cross(np.matmul(Phi,self.cov.cross()))
+
+    def flush_odometry(self):
+        # Bring the pose/landmark cross covariances up to date with the odometry accumulated since the last flush.
+        # Must be called before anything reads P outside of its pose block
+        if not self._odom_pending:
+            return
+        if len(self.x) > 3:
+            self.cov.set_cross(np.matmul(self._Phi_acc,self.cov.cross()))
+        self._odometry_flushed()
+
+    def _odometry_flushed(self):
+        # Nothing accumulated is left to apply
+        self._Phi_acc = np.eye(3)                    # Product of the odometry Jacobians not yet applied to P
+        self._odom_pending = False
+
+    def landmark_update(self, data):
+        landmarks = data.landmarks
+        debug_print('Running update with landmarks: %s', landmarks)
+        debug_print('Prior: %s', self.x[0:3])
+        self.scan = self.scan + 1
+        t0 = self.timer.start()
+        self.flush_odometry()
+        self.timer.stop('odom_flush', t0)
+        # For every landmark observed, run update or add it to state vector
+        # Mahalanobis gate is chi-squared distributed and compared on its own threshold
+        r_t = self.m_t if self.use_mahalanobis else self.r_t
+        matched = []
+        # The whole message at once: the robot frame lines (rho, phi) the correction measures, and the world
+        # frame segment centres, directions and points of the lines closest to the origin the map stores
+        # (see line_model)
+        obs = np.array([[landmark.x, landmark.y, landmark.angle] for landmark in landmarks], dtype=float).reshape(-1,3)
+        t0 = self.timer.start()
+        meas_lines = np.column_stack(hesse_from_points(obs[:,0], obs[:,1], obs[:,2]))
+        centres, angles, closest = observe_segments(self.x[0:3,0], obs[:,0], obs[:,1], obs[:,2])
+        self.timer.stop('transform', t0)
+        rows = 1 if no_bearing else 2
+        for k, landmark in enumerate(landmarks):
+            r = r_t
+            num_landmarks = int((len(self.x)-3)/2)
+            meas_landmark = closest[k:k+1]
+            debug_print('Observed landmark: %s', meas_landmark)
+            # Noise grows with the distance to the wall
+            meas_range = meas_lines[k,0]
+            if no_bearing is False:
+                R = np.array([[self.v_r*meas_range , 0],
+                 [0,  self.v_b*meas_range]])
+            else:
+                R = self.v_r*meas_range
+
+            # Use ML estimator for data assosciation, scoring every nearby landmark at once
+            t0 = self.timer.start()
+            candidates = self.grid.query(meas_landmark[0], self.gate_radius, landmark_positions(self.x))
+            ind, gate = associate(self.x, self.cov, meas_landmark, R, self.use_mahalanobis, no_bearing is False, candidates)
+            if ind is not None:
+                r = gate
+                debug_print('Best match: landmark %d with gate value %s', ind, gate)
+            self.timer.stop('association', t0)
+
+            # If no known correspondance, add landmark to state vector
+            if r >= r_t:
+                t0 = self.timer.start()
+                n = len(self.x)
+                self._reserve(n+2)
+                self._set_size(n+2)
+                self.x[n:n+2,0] = meas_landmark[0]
+                self.landmarks[num_landmarks] = [landmark.radius, angles[k], centres[k,0], centres[k,1]]
+                debug_print('Landmark appended to state vector, new state vector: %s', self.x)
+                self._init_landmark(R)
+                self.lm_obs[num_landmarks] = [1, self.scan]
+                self.grid.add(meas_landmark[0])
+                self.data['lm_info'] = self.landmarks
+                self.timer.stop('insertion', t0)
+                # If known correspondance, we run an update from that landmark    
+            else: 
+                # predicted landmark found from ML estimator
+                pred_landmark = self.x[3+2*ind:5+2*ind,0].reshape(1,2)
+                self.lm_obs[ind] = [self.lm_obs[ind,0] + 1, self.scan]
+                debug_print('Recorded landmark %d %s', ind, pred_landmark)
+                # Robot frame line predicted from the landmark, the observed one written with the same normal
+                pred, Hx, Hm = predict_lines(self.x[0:3,0], pred_landmark, self.landmarks[ind:ind+1,1])
+                meas = align_observations(meas_lines[k:k+1], pred)
+                err = line_innovations(meas, pred)[0,0:rows].reshape(-1,1)
+                Hx = Hx[0,0:rows]
+                Hm = Hm[0,0:rows]
+                debug_print('Error: %s Pred: %s Meas: %s', err, pred, meas)
+                if self.batch_update:
+                    matched.append((Hx, ind, Hm, err, np.atleast_2d(R)))
+                else:
+                    self.sparse_update(Hx, ind, Hm, err, np.atleast_2d(R))
+                    debug_print('Update: %s', self.x)
+                    # The pose moved, so the rest of the message has to be placed in the world again
+                    centres, angles, closest = observe_segments(self.x[0:3,0], obs[:,0], obs[:,1], obs[:,2])
+            self.data['state'] = self.x 
+            #self.q.put(self.data)
+        # In batch mode every match from the message goes into one stacked correction
+        if len(matched) > 0:
+            self.stacked_update(matched)
+            debug_print('Update: %s', self.x)
+        if self.merge_every > 0 and self.scan % self.merge_every == 0:
+            t0 = self.timer.start()
+            self.merge_duplicates()
+            self.timer.stop('merge', t0)
+        if self.prune_age > 0 and self.scan % self.prune_every == 0:
+            t0 = self.timer.start()
+            self.prune_landmarks()
+            self.timer.stop('prune', t0)
+
+    def _init_landmark(self, R):
+        # Covariance of the landmark just appended to x and landmarks, observed with noise R. The landmark is
+        # the inverse of the observation model z = h(pose, m): Jz = Hm^-1 and Jxr = -Hm^-1*Hx
+        n = len(self.x) - 2
+        pred, Hx, Hm = predict_lines(self.x[0:3,0], self.x[n:n+2,0].reshape(1,2), self.landmarks[-1:,1])
+        Jz = np.linalg.inv(Hm[0])
+        Jxr = -np.matmul(Jz,Hx[0])
+        if no_bearing is not False:
+            Jz = Jz[:,0:1]
+        Ppp = self.cov.pose_block()
+        C = np.matmul(Jxr,np.matmul(Ppp,np.transpose(Jxr))) + np.matmul(Jz,np.matmul(np.atleast_2d(R),np.transpose(Jz))) # Jxr*P*Jxr^T + Jz*R*Jz^T
+        G = np.matmul(Ppp,np.transpose(Jxr))                                          # P*Jxr^T
+        # The landmark inherits the pose's correlation with the map, without it P stops being positive definite
+        L = np.matmul(Jxr,self.cov.cross()[:,0:n-3])                                  # Jxr*P_pm
+        self.cov.add_landmark(G, L, C)                                                      # New Cov Matrix
+
+    def confirmed(self):
+        # Mask of the landmarks seen often enough to be kept for good
+        return self.lm_obs[:,0] >= self.confirm_count
+
+    def prune_landmarks(self):
+        # Remove tentative landmarks not observed for more than prune_age scans, most of them are one-off
+        # misdetections or duplicates the association missed. Dropping a landmark's rows and columns from
+        # x and P marginalizes it out of the gaussian exactly. Returns the number removed
+        drop = np.logical_and(np.logical_not(self.confirmed()), self.scan - self.lm_obs[:,1] > self.prune_age)
+        n_drop = int(np.sum(drop))
+        if n_drop == 0:
+            return 0
+        self._remove_landmarks(drop)
+        self.pruned = self.pruned + n_drop
+        debug_print('Pruned %d landmarks, %d left', n_drop, len(self.landmarks))
+        return n_drop
+
+    def merge_duplicates(self):
+        # Map maintenance: a wall seen as several overlapping segments ends up as several landmarks with
+        # (nearly) the same closest point and direction. Fuse every such pair with a perfect pseudo
+        # observation m_i - m_j = 0, so the kept landmark gets the information of both, then drop the
+        # duplicate. The kept row gets the union of both segments' extents. Returns the number fused
+        self.flush_odometry()
+        lm_pos = landmark_positions(self.x)
+        drop = np.zeros(len(self.landmarks), dtype=bool)
+        for i in range(len(self.landmarks)):
+            if drop[i]:
+                continue
+            for j in self.grid.query(lm_pos[i], self.merge_radius, lm_pos):
+                if j <= i or drop[j]:
+                    continue
+                d = (self.landmarks[i,1] - self.landmarks[j,1]) % np.pi
+                if min(d, np.pi - d) > self.merge_angle:
+                    continue
+                self._fuse_landmarks(i, j)
+                drop[j] = True
+        n_drop = int(np.sum(drop))
+        if n_drop == 0:
+            return 0
+        self._remove_landmarks(drop)
+        self.merged = self.merged + n_drop
+        debug_print('Fused %d duplicate landmarks, %d left', n_drop, len(self.landmarks))
+        return n_drop
+
+    def _fuse_landmarks(self, i, j):
+        self._fuse_state(i, j)
+        # The kept row covers both segments
+        self.landmarks[i] = segment_union(self.landmarks[i], self.landmarks[j])
+        self.lm_obs[i] = [self.lm_obs[i,0] + self.lm_obs[j,0], max(self.lm_obs[i,1], self.lm_obs[j,1])]
+
+    def _fuse_state(self, i, j):
+        # EKF update with H = [0 .. I (at i) .. -I (at j) .. 0], z = 0 and a tiny R
+        a = 3+2*i
+        b = 3+2*j
+        self._workspace(2)
+        HP = self.cov.landmark_rows(i, self._ws_rows[0:2]) - self.cov.landmark_rows(j, self._ws_rows[3:5])
+        S = HP[:,a:a+2] - HP[:,b:b+2] + 1e-9*np.eye(2)
+        KT = Innovation(S).solve(HP)
+        self.x -= np.matmul(np.transpose(KT),self.x[a:a+2] - self.x[b:b+2])
+        self.x[2,0] = wrap_to_pi(self.x[2,0])
+        self.cov.rank_update(KT, HP, self._ws_tmp)
+
+    def _remove_landmarks(self, drop):
+        # Delete the landmarks flagged in drop from x, P and the landmark tables, keeping the order of the rest
+        keep_lm = np.nonzero(np.logical_not(drop))[0]
+        keep = np.concatenate((np.arange(3), (3 + 2*keep_lm[:,None] + np.arange(2)).ravel()))
+        m = len(keep)
+        # Compact in place, the fancy indexed right hand sides are copies so overlapping rows are fine
+        self.x[0:m] = self.x[keep]
+        self.cov.compact(keep)
+        self.landmarks[0:len(keep_lm)] = self.landmarks[keep_lm]
+        self.lm_obs[0:len(keep_lm)] = self.lm_obs[keep_lm]
+        self._set_size(m)
+        self.grid.rebuild(landmark_positions(self.x))
+        self.data['state'] = self.x
+        self.data['lm_info'] = self.landmarks
+
+    def sparse_update(self, Hx, ind, Hm, err, R):
+        # EKF correction for an observation with H = [Hx 0 .. Hm .. 0], Hm sitting in the columns of landmark ind
+        self.stacked_update([(Hx, ind, Hm, err, R)])
+
+    def _workspace(self, m):
+        # Make sure the scratch buffers cover the state capacity and a stack of m observation rows.
+        # They only grow, so once the map and the messages stop growing nothing is allocated per update
+        cap = len(self._x_buf)
+        rows = max(m, self._ws_HP.shape[0])
+        if self._ws_HP.shape[1] >= cap and self._ws_HP.shape[0] >= m:
+            return
+        self._ws_HP = np.empty((rows,cap))
+        self._ws_KT = np.empty(rows*cap)            # Flat so K^T can be viewed Fortran ordered for in place solves
+        self._ws_tmp = np.empty((max(rows,UPDATE_BLOCK),cap))
+        self._ws_dx = np.empty((1,cap))
+        self._ws_rows = np.empty((5,cap))
+
+    def stacked_update(self, obs):
+        # One EKF correction for a list of (Hx, ind, Hm, err, R) observations, stacked into a single H with a
+        # block diagonal R. Only the pose and matched landmark rows of P are read, so this is O(k*n^2) rather
+        # than O(n^3). P is symmetric, so P*H^T is just (H*P)^T and the correction P -= K*S*K^T = K*(H*P)
+        # is applied in place a block of rows at a time, all n sized temporaries live in preallocated buffers
+        t0 = self.timer.start()
+        n = len(self.x)
+        m = sum([len(o[0]) for o in obs])
+        self._workspace(m)
+        HP = self._ws_HP[0:m,0:n]
+        KT = self._ws_KT[0:m*n].reshape((m,n), order='F')
+        tmp = self._ws_tmp
+        # Pose and landmark rows of P, views of dense storage, gathered into scratch rows otherwise
+        Pp = self.cov.pose_rows(self._ws_rows[0:3])
+        S = np.zeros((m,m))
+        err = np.empty((m,1))
+        k = 0
+        for Hx, ind, Hm, e, R in obs:
+            rows = len(Hx)
+            np.matmul(Hx,Pp,out=HP[k:k+rows])                              # H*P
+            np.matmul(Hm,self.cov.landmark_rows(ind, self._ws_rows[3:5]),out=tmp[0:rows,0:n])
+            HP[k:k+rows] += tmp[0:rows,0:n]
+            S[k:k+rows,k:k+rows] = R
+            err[k:k+rows] = e
+            k = k + rows
+        k = 0
+        for Hx, ind, Hm, e, R in obs:
+            j = 3+2*ind
+            rows = len(Hx)
+            S[:,k:k+rows] += np.matmul(HP[:,0:3],np.transpose(Hx)) + np.matmul(HP[:,j:j+2],np.transpose(Hm))  # H*P*H^T + R
+            k = k + rows
+        S = 0.5*(S + np.transpose(S))
+        innovation = Innovation(S)
+        KT[...] = HP
+        KT = innovation.solve(KT, overwrite=True)    # K^T = (H*P*H^T + R)^-1*H*P
+        self.log_likelihood = self.log_likelihood + innovation.log_likelihood(err)
+        self.timer.stop('gain', t0)
+        debug_print('Gain: %s', np.transpose(KT))
+        t0 = self.timer.start()
+        dx = self._ws_dx[:,0:n]
+        np.matmul(np.transpose(err),KT,out=dx)
+        self.x += np.transpose(dx)                   # x = x + K*(y-h(x))
+        self.x[2,0] = wrap_to_pi(self.x[2,0])
+        self.cov.rank_update(KT, HP, tmp)            # (I-K*H)*P = P - K*S*K^T
+        self.grid.update(landmark_positions(self.x))
+        self.timer.stop('cov_update', t0)
+
+    def stage_stats(self):
+        # Per-stage call counts and latency percentiles, empty unless the profile parameter is set
+        return self.timer.stats()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Tk/matplotlib visualization for slam_node, run in its own process. Only imported
+# when the GUI is enabled, so headless nodes never load matplotlib or Tk.
+import sys
+import multiprocessing
+import numpy as np
+import matplotlib
+matplotlib.use('TkAgg')
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2TkAgg
+# implement the default mpl key bindings
+from matplotlib.backend_bases import key_press_handler
+from matplotlib.figure import Figure
+import matplotlib.pyplot as plt
+from matplotlib.ticker import FormatStrFormatter
+from matplotlib.patches import Ellipse
+from matplotlib.collections import LineCollection
+
+if sys.version_info[0] < 3:
+    import Tkinter as Tk
+else:
+    import tkinter as Tk
+
+if sys.version_info[0] < 3:
+    import Queue as queue
+else:
+    import queue
+
+class StdOutListener():
+    def __init__(self, num):
+        self.fig = Figure(figsize=(5, 5), dpi=100)
+        # black like my soul
+        #self.fig.patch.set_facecolor('white')
+        self.fig.patch.set_edgecolor('white')
+        self.num = num
+        self.start_time = None
+        self.x = []
+        self.y = []
+        self.real_x = []
+        self.real_y = []
+        self.lx = []
+        self.ly = []
+        self.my_average = []
+        self.sub = self.fig.add_subplot(111)
+        self.sub.set_xlabel('x (m)')
+        # List probably needs to be changed if any graphs are modified/added
+        self.sub.set_ylabel('y (m)')
+        self.sub.spines['bottom'].set_color('black')
+        self.sub.xaxis.label.set_color('black')
+        self.sub.yaxis.label.set_color('black')
+        self.sub.tick_params(axis = 'x', colors = 'black')
+        self.sub.tick_params(axis = 'y', colors = 'black')
+        # Persistent artists, on_data only changes their data. The trajectory history is baked into the
+        # blit background, so a frame only draws the newest trajectory segment and the landmark lines
+        self.est_hist, = self.sub.plot([], [], '.-', color='blue')
+        self.real_hist, = self.sub.plot([], [], '.-', color='green')
+        self.est_seg, = self.sub.plot([], [], '.-', color='blue', animated=True)
+        self.real_seg, = self.sub.plot([], [], '.-', color='green', animated=True)
+        self.lm_lines = LineCollection([], colors='red', animated=True)
+        self.sub.add_collection(self.lm_lines)
+        self.background = None
+        self.trajectory = None          # full trajectories when the transport provides them
+        self.real_trajectory = None
+        self.fig.canvas.mpl_connect('resize_event', self._invalidate)
+
+    def _invalidate(self, event=None):
+        self.background = None
+
+    def _in_view(self, xs, ys):
+        xmin, xmax = self.sub.get_xlim()
+        ymin, ymax = self.sub.get_ylim()
+        return np.all((xs >= xmin) & (xs <= xmax) & (ys >= ymin) & (ys <= ymax))
+
+    def _full_redraw(self, segments):
+        # Rescale to fit everything with room to grow, redraw the static artists and grab a new background.
+        # Limits grow geometrically so this happens O(log(run length)) times
+        xs = np.concatenate((self.x, self.real_x, segments[:,:,0].ravel()))
+        ys = np.concatenate((self.y, self.real_y, segments[:,:,1].ravel()))
+        cx, cy = (xs.min()+xs.max())/2, (ys.min()+ys.max())/2
+        half = max(xs.max()-xs.min(), ys.max()-ys.min(), 1.0)
+        self.sub.set_xlim(cx-half, cx+half)
+        self.sub.set_ylim(cy-half, cy+half)
+        if self.trajectory is not None:
+            self.est_hist.set_data(np.array(self.trajectory[:,0]), np.array(self.trajectory[:,1]))
+            self.real_hist.set_data(np.array(self.real_trajectory[:,0]), np.array(self.real_trajectory[:,1]))
+        else:
+            self.est_hist.set_data(self.x, self.y)
+            self.real_hist.set_data(self.real_x, self.real_y)
+        canvas[self.num].draw()
+        self.background = canvas[self.num].copy_from_bbox(self.sub.bbox)
+
+    # On_data adds the new pose to the trajectories and redraws the landmark map
+    def on_data(self, x, landmarks, pose, trajectory=None, real_trajectory=None):
+        self.trajectory = trajectory
+        self.real_trajectory = real_trajectory
+        self.x.append(x[0,0])
+        self.y.append(x[1,0])
+        self.real_x.append(pose[0,0])
+        self.real_y.append(pose[1,0])
+        # Landmark lines as segments of +-radius around their position, along their angle
+        numLandmarks = int((len(x)-3)/2)
+        segments = np.zeros((numLandmarks,2,2))
+        if numLandmarks > 0:
+            lms = landmarks[0:numLandmarks]
+            d = np.transpose([lms[:,0]*np.cos(lms[:,1]), lms[:,0]*np.sin(lms[:,1])])
+            segments[:,0,:] = lms[:,2:4] - d
+            segments[:,1,:] = lms[:,2:4] + d
+
+        if (self.background is None
+                or not self._in_view(np.array([self.x[-1], self.real_x[-1]]), np.array([self.y[-1], self.real_y[-1]]))
+                or not self._in_view(segments[:,:,0], segments[:,:,1])):
+            self._full_redraw(segments)
+        else:
+            # Add the newest trajectory segment to the background
+            canvas[self.num].restore_region(self.background)
+            self.est_seg.set_data(self.x[-2:], self.y[-2:])
+            self.real_seg.set_data(self.real_x[-2:], self.real_y[-2:])
+            self.sub.draw_artist(self.est_seg)
+            self.sub.draw_artist(self.real_seg)
+            self.background = canvas[self.num].copy_from_bbox(self.sub.bbox)
+        self.lm_lines.set_segments(segments)
+        self.sub.draw_artist(self.lm_lines)
+        canvas[self.num].blit(self.sub.bbox)
+
+    # This method is used to clear X/Y data and redraw all plots
+    def clear_data(self):
+        self.start_time = None
+        self.x = []
+        self.y = []
+        self.real_x = []
+        self.real_y = []
+        self.lx = []
+        self.ly = []
+        self.est_hist.set_data([], [])
+        self.real_hist.set_data([], [])
+        self.lm_lines.set_segments([])
+        ax = canvas[self.num].figure.axes[0]
+        ax.set_ylim(0, 1)
+        ax.set_xlim(0, 1)
+        canvas[self.num].draw()
+        self.background = canvas[self.num].copy_from_bbox(self.sub.bbox)
+
+#def on_key_event(event):
+#    debug_print('you pressed %s' % event.key)
+#    key_press_handler(event, canvas, toolbar)
+
+# Basic test method for adding random data to the plots
+def updateGraph(out_listener, q, textBoxes):
+    global start
+    # start is used as a flag to control program operation
+    # 0 = Stop all graphing
+    # 1 = Run main program for Xbee data
+    # 2 = Run random numbers
+
+    if start == 1:
+        try:
+            dict_data = q.get_latest()
+        except queue.Empty:
+            root.after(10, updateGraph, out_listener, q, textBoxes)
+            return
+        # This list must be expanded if graphs are added/modified
+        data = dict_data['state']
+        landmarks = dict_data['lm_info']
+        pose = dict_data['real_pose']
+        out_listener[0].on_data(data,landmarks,pose,dict_data.get('trajectory'),dict_data.get('real_trajectory'))
+        textBoxes[0].configure(state = 'normal')
+        textBoxes[0].delete('1.0', Tk.END)
+        textBoxes[0].insert(Tk.INSERT, "Pose:\nx: " + str(int(data[0,0])) + "\ny: " + str(int(data[1,0])) + "\ntheta: " + str(int(data[2,0]*180/np.pi)))
+        textBoxes[0].configure(state = 'disabled')
+        textBoxes[1].configure(state = 'normal')
+        textBoxes[1].delete('1.0', Tk.END)
+        textBoxes[1].insert(Tk.INSERT, "Num landmarks:\n" + str(int((len(data)-3)/2)))
+        textBoxes[1].configure(state = 'disabled')
+        root.after(10, updateGraph, out_listener, q, textBoxes)
+        return # Return to prevent extra after() call
+    elif start == 2:
+        for listener in out_listener:
+            listener.on_data(np.random.randint(-5,50))
+    after_id = root.after(10, updateGraph, out_listener, 0, 0)
+    if not start:
+        if after_id is not None:
+            root.after_cancel(after_id)
+        return
+
+# Called when quit button pressed
+def _quit():
+    root.quit()     # stops mainloop
+    root.destroy()  # this is necessary on Windows to prevent
+                    # Fatal Python Error: PyEval_RestoreThread: NULL tstate
+
+# Called when clear button pressed
+def _clearData(out_listener):
+    for listener in out_listener:
+        listener.clear_data()
+
+# Called when run button pressed
+def _startRun(out_listener, q, textBoxes):
+    global start
+    start = 1
+    updateGraph(out_listener, q, textBoxes)
+    
+
+class TkGUI(multiprocessing.Process):
+    def __init__(self, q):
+        multiprocessing.Process.__init__(self)
+        self.q = q
+
+    def run(self):
+        global canvas
+        global root
+        # global startTest
+        # startTest = False
+        root = Tk.Tk()
+        root.wm_title("SLAM Visualization")
+        root.configure(background = 'white') # black like my soul
+
+        plt.ion()                            # ion() allows matplotlib to update animations.
+        canvas = []
+        out_listener = []
+
+        # This and figure size need modification if number of figures greater than 6
+        for i in range(1):
+            out_listener.append(StdOutListener(i))
+            # a tk.DrawingArea
+            canvas.append(FigureCanvasTkAgg(out_listener[i].fig, master=root))
+            if i < 3:
+                vRow = 0
+                vCol = i
+            else:
+                vRow = 1
+                vCol = i - 3
+            canvas[i].get_tk_widget().grid(row=20*vRow, column=2*vCol, ipadx = 41, columnspan=2, rowspan=20)
+            canvas[i].get_tk_widget().configure(background='white',  highlightcolor='black', highlightbackground='black')
+            #toolbar = NavigationToolbar2TkAgg(canvas, root)      # Nobody likes toolbars anyway.
+            #toolbar.update()
+            # I am not completely sure how tkcanvas.grid vs get_tk_widget().grid are different
+            canvas[i]._tkcanvas.grid(row=20*vRow, column=2*vCol, ipadx = 41, columnspan=2, rowspan=20)
+
+        # Creates delete, stop, start, and clear button objects
+        clearDataButton = Tk.Button(master=root, width=19, bd=1, bg='white', fg='black', text='Clear', command=lambda: _clearData(out_listener))
+        startRunButton = Tk.Button(master=root, width=19, bd=1, bg='white', fg='black', text='Run', command=lambda: _startRun(out_listener, self.q, textBoxes))
+        quitButton = Tk.Button(master=root, width=19, bd=1, fg='black', bg='white', text='Quit', command=lambda: _quit())
+
+        # Text boxes in 'normal' mode by default. Set to disabled to make uneditable.
+        poseText = Tk.Text(root, height=4, fg='black', bg='white', bd=0, highlightthickness=0, width=19)
+        poseText.insert(Tk.INSERT, "Pose:\nx:0\ny:0\ntheta:0")
+        poseText.configure(state = 'disabled')
+        lmTxt = Tk.Text(root, height=2, fg='black', bg='white', bd=0, highlightthickness=0, width=19)
+        lmTxt.insert(Tk.INSERT, "Num landmarks:\n0")
+        lmTxt.configure(state = 'disabled')
+        textBoxes = []
+        textBoxes.append(poseText)
+        textBoxes.append(lmTxt)
+
+        # Calling grid() to place objects
+        poseText.grid(column = 6, row = 0)
+        lmTxt.grid(column = 6, row = 1)
+        startRunButton.grid(column = 6, row = 17)
+        clearDataButton.grid(column = 6, row = 18)
+        quitButton.grid(column = 6, row = 19)
+        #canvas[0].mpl_connect('key_press_event', on_key_event)
+
+        root.mainloop()
+        sys.exit()
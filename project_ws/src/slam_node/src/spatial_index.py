@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Uniform grid over landmark positions so association only has to look at the
+# landmarks near an observation instead of the whole map.
+import numpy as np
+
+
+class LandmarkGrid():
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}                           # (cx,cy) -> list of landmark indices
+        self.keys = np.zeros((16,2), dtype=int)   # cell of every indexed landmark
+        self.size = 0
+
+    def _key(self, pos):
+        return np.floor(np.asarray(pos, dtype=float)/self.cell_size).astype(int)
+
+    def add(self, pos):
+        # Index a new landmark, it gets the next landmark index
+        if self.size == len(self.keys):
+            keys = np.zeros((2*len(self.keys),2), dtype=int)
+            keys[0:self.size] = self.keys[0:self.size]
+            self.keys = keys
+        key = self._key(pos)
+        self.keys[self.size] = key
+        self.cells.setdefault((key[0],key[1]), []).append(self.size)
+        self.size = self.size + 1
+
+    def update(self, lm_pos):
+        # Re-bin the landmarks that moved to another cell after a correction, lm_pos is (size,2)
+        keys = self._key(lm_pos)
+        moved = np.nonzero(np.any(keys != self.keys[0:self.size], axis=1))[0]
+        for i in moved:
+            old = (self.keys[i,0], self.keys[i,1])
+            self.cells[old].remove(i)
+            if not self.cells[old]:
+                del self.cells[old]
+            self.cells.setdefault((keys[i,0],keys[i,1]), []).append(i)
+        self.keys[0:self.size] = keys
+
+    def rebuild(self, lm_pos):
+        # Drop everything and index lm_pos from scratch (after landmarks are removed or renumbered)
+        self.cells = {}
+        self.size = 0
+        for pos in lm_pos:
+            self.add(pos)
+
+    def query(self, point, radius, lm_pos):
+        # Indices of the landmarks within radius of point
+        key = self._key(point)
+        reach = int(np.ceil(radius/self.cell_size))
+        found = []
+        for cx in range(key[0]-reach, key[0]+reach+1):
+            for cy in range(key[1]-reach, key[1]+reach+1):
+                cell = self.cells.get((cx,cy))
+                if cell:
+                    found.extend(cell)
+        found = np.array(found, dtype=int)
+        if len(found) > 0:
+            d = lm_pos[found] - np.asarray(point, dtype=float).reshape(2)
+            found = found[np.sum(np.square(d), axis=1) <= radius*radius]
+        return found
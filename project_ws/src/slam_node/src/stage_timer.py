@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Per-stage latency histograms for the filter hot path. Disabled timers return
+# from start/stop straight away, so leaving the calls in costs next to nothing.
+import os
+import time
+import bisect
+
+# Bucket upper edges in seconds, four per decade from 1 us to 10 s
+BUCKETS = [10**(e/4.0) for e in range(-24, 5)]
+
+
+class StageTimer():
+    # Usage: t = timer.start() ... timer.stop('stage', t)
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.counts = {}
+        self.totals = {}
+        self.maxima = {}
+        self.hists = {}
+
+    def start(self):
+        if not self.enabled:
+            return 0
+        return time.time()
+
+    def stop(self, stage, t0):
+        if not self.enabled:
+            return
+        dt = time.time() - t0
+        if stage not in self.counts:
+            self.totals[stage] = 0.0
+            self.maxima[stage] = 0.0
+            self.hists[stage] = [0]*(len(BUCKETS) + 1)
+            self.counts[stage] = 0
+        self.counts[stage] += 1
+        self.totals[stage] += dt
+        if dt > self.maxima[stage]:
+            self.maxima[stage] = dt
+        self.hists[stage][bisect.bisect_left(BUCKETS, dt)] += 1
+
+    def _percentile(self, stage, p):
+        # Upper edge of the bucket the p-th percentile falls in
+        target = p/100.0*self.counts[stage]
+        seen = 0
+        for i, n in enumerate(self.hists[stage]):
+            seen += n
+            if seen >= target and n > 0:
+                return min(BUCKETS[i], self.maxima[stage]) if i < len(BUCKETS) else self.maxima[stage]
+        return self.maxima[stage]
+
+    def stats(self):
+        # {stage: {count, total_s, mean_us, p50_us, p95_us, p99_us, max_us, hist}}
+        # Safe to call from another thread than the one timing, counts is the last dict a new stage is added to
+        out = {}
+        for stage in list(self.counts):
+            n = self.counts[stage]
+            if n == 0:
+                continue
+            out[stage] = {'count': n, 'total_s': self.totals[stage], 'mean_us': 1e6*self.totals[stage]/n,
+                          'p50_us': 1e6*self._percentile(stage, 50), 'p95_us': 1e6*self._percentile(stage, 95),
+                          'p99_us': 1e6*self._percentile(stage, 99), 'max_us': 1e6*self.maxima[stage],
+                          'hist': list(self.hists[stage])}
+        return out
+
+    def dump_csv(self, path):
+        # Append one row per stage with the totals so far
+        new = not os.path.exists(path)
+        now = time.time()
+        with open(path, 'a') as f:
+            if new:
+                f.write('time,stage,count,total_s,mean_us,p50_us,p95_us,p99_us,max_us\n')
+            for stage, s in sorted(self.stats().items()):
+                f.write('%.3f,%s,%d,%.6f,%.1f,%.1f,%.1f,%.1f,%.1f\n' % (now, stage, s['count'], s['total_s'], s['mean_us'],
+                                                                     s['p50_us'], s['p95_us'], s['p99_us'], s['max_us']))
+
+    def summary(self):
+        lines = ['%-14s %8s %10s %10s %10s %10s' % ('stage', 'calls', 'mean us', 'p50 us', 'p99 us', 'max us')]
+        for stage, s in sorted(self.stats().items()):
+            lines.append('%-14s %8d %10.1f %10.1f %10.1f %10.1f' % (stage, s['count'], s['mean_us'], s['p50_us'],
+                                                                  s['p99_us'], s['max_us']))
+        return '\n'.join(lines)
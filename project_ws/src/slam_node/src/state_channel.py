@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Channels carrying filter snapshots from the SLAM process to the GUI process.
+# The GUI only ever wants the newest state, so these never build a backlog.
+import os
+import sys
+import copy
+import time
+import multiprocessing
+import numpy as np
+
+if sys.version_info[0] < 3:
+    import Queue as queue
+else:
+    import queue
+
+# Shared memory segments need python 3.8, the queue based channel works everywhere
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+class StateChannel():
+    # Latest-value channel over a small multiprocessing.Queue. The publisher is
+    # rate limited, and both ends throw away stale snapshots instead of queueing them.
+    # The last snapshot skipped by the rate limit is remembered and published by
+    # flush() once the period is over, so the GUI catches up when the filter goes idle.
+    def __init__(self, max_rate=20.0, maxsize=2):
+        self.q = multiprocessing.Queue(maxsize)
+        self.min_period = 1.0/max_rate if max_rate > 0 else 0
+        self.last_publish = 0                       # publisher side only
+        self.pending = None                         # snapshot put() skipped last, publisher side only
+        self.skipped = multiprocessing.Value('L', 0)  # put() calls inside the rate limit
+        self.dropped = multiprocessing.Value('L', 0)  # published snapshots the consumer never used
+
+    def _count(self, counter):
+        with counter.get_lock():
+            counter.value += 1
+
+    def _due(self):
+        # Rate limit for the publisher side
+        now = time.time()
+        if now - self.last_publish < self.min_period:
+            self._count(self.skipped)
+            return False
+        self.last_publish = now
+        return True
+
+    def put(self, data):
+        if not self._due():
+            self.pending = data
+            return
+        self.pending = None
+        # The queue pickles in a background thread, so hand it a copy the filter cannot change under it
+        data = copy.deepcopy(data)
+        try:
+            self.q.put_nowait(data)
+        except queue.Full:
+            # Make room by throwing away the oldest snapshot, the consumer only wants the newest
+            try:
+                self.q.get_nowait()
+                self._count(self.dropped)
+            except queue.Empty:
+                pass
+            try:
+                self.q.put_nowait(data)
+            except queue.Full:
+                self._count(self.dropped)
+
+    def flush(self):
+        # Publish the snapshot put() skipped last once the rate limit allows it. Called on the publisher's thread
+        # when no put may come for a while, returns the seconds to wait before calling again or None when
+        # nothing is left. The snapshot is held by reference, the filter's data dict then holds its newest state
+        if self.pending is None:
+            return None
+        wait = self.last_publish + self.min_period - time.time()
+        if wait > 0:
+            return wait
+        self.put(self.pending)
+        return None
+
+    def get_latest(self):
+        # Newest snapshot available, raises queue.Empty if nothing arrived since the last call
+        data = self.q.get(block=False)
+        while True:
+            try:
+                newer = self.q.get(block=False)
+            except queue.Empty:
+                return data
+            self._count(self.dropped)
+            data = newer
+
+    def stats(self):
+        return {'skipped': self.skipped.value, 'dropped': self.dropped.value}
+
+    def close(self):
+        self.q.close()
+
+
+class SharedStateTransport(StateChannel):
+    # Same interface as StateChannel, but snapshots are written into a double-buffered shared memory
+    # region instead of being pickled. A sequence counter says which buffer is current, the reader copies
+    # it out and retries if the writer published again meanwhile, so a reader that falls behind never
+    # gets a half overwritten snapshot.
+    # The trajectory is append-only (a ring of max_traj points) and shared by both buffers.
+    def __init__(self, max_rate=20.0, max_landmarks=5000, max_traj=100000):
+        if shared_memory is None:
+            raise RuntimeError('SharedStateTransport needs multiprocessing.shared_memory (python 3.8+)')
+        self.min_period = 1.0/max_rate if max_rate > 0 else 0
+        self.last_publish = 0
+        self.skipped = multiprocessing.Value('L', 0)
+        self.dropped = multiprocessing.Value('L', 0)
+        self.cap_state = 3+2*max_landmarks
+        self.cap_lm = max_landmarks
+        self.cap_traj = max_traj
+        self.slot_size = self.cap_state + 4*self.cap_lm + 2
+        size = 8*(8 + 2*self.slot_size + 4*self.cap_traj)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.owner = True
+        self.traj_count = 0          # writer side
+        self.last_seq = 0            # reader side
+        self.pending = None          # writer side
+        self._views_pid = None
+        self._views()[0][:] = 0
+
+    def __getstate__(self):
+        # Only the segment name travels to a spawned process, it reattaches and rebuilds its views there
+        state = self.__dict__.copy()
+        state['shm'] = self.shm.name
+        state['_views_pid'] = None
+        state['pending'] = None
+        for key in ('_header', '_slots', '_traj'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=self.shm)
+        self.owner = False
+
+    def _views(self):
+        # header: seq, then (state size, landmark count, trajectory count) for each buffer
+        if self._views_pid != os.getpid():
+            self._header = np.ndarray((8,), dtype=np.int64, buffer=self.shm.buf)
+            body = np.ndarray((2*self.slot_size + 4*self.cap_traj,), dtype=np.float64, buffer=self.shm.buf, offset=64)
+            self._slots = []
+            for slot in range(2):
+                base = slot*self.slot_size
+                self._slots.append((body[base:base+self.cap_state],
+                                    body[base+self.cap_state:base+self.cap_state+4*self.cap_lm].reshape(self.cap_lm,4),
+                                    body[base+self.slot_size-2:base+self.slot_size]))
+            base = 2*self.slot_size
+            self._traj = (body[base:base+2*self.cap_traj].reshape(self.cap_traj,2),
+                          body[base+2*self.cap_traj:base+4*self.cap_traj].reshape(self.cap_traj,2))
+            self._views_pid = os.getpid()
+        return self._header, self._slots, self._traj
+
+    def put(self, data):
+        if not self._due():
+            self.pending = data
+            return
+        self.pending = None
+        header, slots, traj = self._views()
+        x = data['state']
+        lm = data['lm_info']
+        n = len(x)
+        k = 0 if lm is None else len(lm)
+        if n > self.cap_state or k > self.cap_lm:
+            self._count(self.dropped)
+            return
+        seq = header[0] + 1
+        slot = seq % 2
+        state, lm_info, real_pose = slots[slot]
+        state[0:n] = x[:,0]
+        if k > 0:
+            lm_info[0:k] = lm[0:k]
+        real_pose[:] = np.reshape(data.get('real_pose', np.zeros(2)), 2)
+        traj[0][self.traj_count % self.cap_traj] = x[0:2,0]
+        traj[1][self.traj_count % self.cap_traj] = real_pose
+        self.traj_count = self.traj_count + 1
+        header[1+3*slot:4+3*slot] = [n, k, self.traj_count]
+        # Publishing is the sequence bump, everything above went into the buffer nobody is reading
+        header[0] = seq
+
+    def _trajectory(self, ring, count):
+        if count <= self.cap_traj:
+            return ring[0:count]
+        start = count % self.cap_traj
+        return np.concatenate((ring[start:], ring[0:start]))
+
+    def get_latest(self):
+        # Copies the newest slot out (a seqlock read): once the writer has published seq+1 it may already be
+        # filling seq+2 into the slot being copied, so the copy only counts if seq is still the newest after it
+        header, slots, traj = self._views()
+        seq = int(header[0])
+        if seq == self.last_seq:
+            raise queue.Empty
+        while True:
+            slot = seq % 2
+            n, k, count = header[1+3*slot:4+3*slot]
+            state, lm_info, real_pose = slots[slot]
+            data = {'state': state[0:n].reshape(n,1).copy(),
+                    'lm_info': lm_info[0:k].copy() if k > 0 else None,
+                    'real_pose': real_pose.reshape(2,1).copy(),
+                    'trajectory': self._trajectory(traj[0], count).copy(),
+                    'real_trajectory': self._trajectory(traj[1], count).copy()}
+            latest = int(header[0])
+            if latest == seq:
+                break
+            seq = latest
+        if seq > self.last_seq + 1:
+            with self.dropped.get_lock():
+                self.dropped.value += seq - self.last_seq - 1
+        self.last_seq = seq
+        return data
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
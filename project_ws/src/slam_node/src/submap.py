@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Submap engine, selected with the 'engine' parameter (see slam_core.make_filter).
+# The map is cut into submaps: each is a small EKF (a SLAM instance) in its own
+# frame, whose origin is the robot pose the submap was started at. Once the
+# active submap holds submap_landmarks landmarks or the robot has travelled
+# submap_distance in it, its frozen landmarks are handed to the MapMerger and a
+# new submap is started where the robot stands. Consecutive submaps are linked by
+# the base pose of the new one in the old one's frame, with its covariance, and the
+# covariance of the chained base poses is carried into the world frame landmark
+# covariances the merger weighs. The new submap is seeded with the old one's
+# confirmed landmarks around the robot, so it keeps localizing against walls
+# already mapped. Only the active submap is updated at sensor rate, so a scan
+# costs what the submap costs however large the map grows. The merger fuses the
+# finished submaps into one global map on a background thread, x and landmarks
+# show that map plus the active submap in the world frame.
+import threading
+from collections import deque
+import numpy as np
+from association import landmark_positions
+from line_model import segments_to_world, lines_to_frame, lines_into_frame, segment_union
+from spatial_index import LandmarkGrid
+from stage_timer import StageTimer
+from slam_core import SLAM, apply_params, wrap_to_pi, debug_print
+
+BASE_P0 = [1e-6, 1e-6, 1e-6]   # Pose covariance a submap after the first starts with, its base link carries the rest
+
+
+def compose(a, b):
+    # Pose b given in the frame at pose a, in a's outer frame
+    c, s = np.cos(a[2]), np.sin(a[2])
+    return np.array([a[0] + c*b[0] - s*b[1], a[1] + s*b[0] + c*b[1], wrap_to_pi(a[2] + b[2])])
+
+
+def compose_jacobians(a, b):
+    # Jacobians of compose(a, b) by a and by b
+    c, s = np.cos(a[2]), np.sin(a[2])
+    J_a = np.array([[1, 0, -s*b[0] - c*b[1]], [0, 1, c*b[0] - s*b[1]], [0, 0, 1]])
+    J_b = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+    return J_a, J_b
+
+
+class LocalSLAM(SLAM):
+    # Filter of one submap. It remembers where its landmarks came from: origin is the row of a landmark
+    # seeded from the previous submap in that submap's kept landmarks, -1 for one first seen here
+    def __init__(self, q=None, params=None):
+        SLAM.__init__(self, q, params)
+        self.origin = np.zeros(0, dtype=int)
+
+    def _init_landmark(self, R):
+        SLAM._init_landmark(self, R)
+        self.origin = np.append(self.origin, -1)
+
+    def _fuse_landmarks(self, i, j):
+        SLAM._fuse_landmarks(self, i, j)
+        if self.origin[i] < 0:
+            self.origin[i] = self.origin[j]
+
+    def _remove_landmarks(self, drop):
+        self.origin = self.origin[np.logical_not(drop)]
+        SLAM._remove_landmarks(self, drop)
+
+
+class Submap():
+    # What the merger gets of a finished submap, until it is merged: the link to the previous one and its
+    # confirmed landmarks moved to the world frame, with the marginal covariances of their positions. Those
+    # hold the landmarks' spread in the submap plus the spread world_cov of the submap's base pose, chained
+    # over the base links
+    def __init__(self, index, base, world, world_cov, seed_cov, slam, scan_offset):
+        self.index = index
+        self.base = base                # Base pose in the previous submap's frame
+        self.world = world              # Base pose in the world frame
+        self.world_cov = world_cov      # and its covariance
+        keep = np.nonzero(slam.confirmed())[0]
+        P_pp, P_pm, P_mm = slam.cov.blocks(keep)
+        self.positions, J, J_world = lines_to_frame(world, landmark_positions(slam.x)[keep], slam.landmarks[keep,1])
+        # A seeded landmark's own covariance already holds the spread of the base link, so it only gets that of
+        # the links before it, seed_cov
+        W = np.where((slam.origin[keep] >= 0)[:,None,None], seed_cov, world_cov)
+        self.cov = np.matmul(np.matmul(J, P_mm), np.transpose(J, (0, 2, 1))) + \
+            np.matmul(np.matmul(J_world, W), np.transpose(J_world, (0, 2, 1)))
+        self.landmarks = slam.landmarks[keep].copy()
+        self.landmarks[:,2:4], self.landmarks[:,1] = segments_to_world(world, self.landmarks[:,2], self.landmarks[:,3],
+                                                                       self.landmarks[:,1])
+        self.lm_obs = slam.lm_obs[keep] + [0, scan_offset]
+        self.origin = slam.origin[keep]   # Row of each in the previous submap, -1 if first seen in this one
+
+    def nbytes(self):
+        return self.positions.nbytes + self.cov.nbytes + self.landmarks.nbytes + self.lm_obs.nbytes + self.origin.nbytes
+
+
+class MapMerger(threading.Thread):
+    # Fuses finished submaps into the global map in the order they were pushed. A landmark seeded from
+    # the previous submap carries everything that submap knew of it, so it replaces the map landmark merged
+    # from there rather than being fused with it a second time. Any other landmark of the submap that
+    # matches one already in the map (same criteria as SLAM.merge_duplicates) is fused with it by
+    # information weighting, the rest are appended. The map is replaced as a whole after every submap,
+    # so snapshot never sees one half merged. Runs on its own thread, or on the caller's through merge_next
+    def __init__(self, params):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.merge_radius = params['merge_radius']
+        self.merge_angle = params['merge_angle']
+        self.cond = threading.Condition()
+        self.queue = deque()
+        self.running = True
+        # positions (N,2), their covariances (N,2,2), line info (N,4) and observation counts (N,2)
+        self.map = (np.zeros((0,2)), np.zeros((0,2,2)), np.zeros((0,4)), np.zeros((0,2), dtype=int))
+        self.grid = LandmarkGrid(params['gate_radius'])   # Over the map, only touched by merge_next
+        self.last = np.zeros(0, dtype=int)       # Map row of each landmark of the last submap merged
+        self.last_count = np.zeros(0, dtype=int) # and how often that submap had seen it
+        # Stats, guarded by cond
+        self.version = 0                         # Bumped whenever snapshot would change
+        self.merged = 0                          # Submaps merged so far
+        self.fused = 0                           # Landmarks fused with one of an earlier submap
+        self.replaced = 0                        # Landmarks replacing the one they were seeded from
+
+    def push(self, submap):
+        with self.cond:
+            self.queue.append(submap)
+            self.version = self.version + 1
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and len(self.queue) == 0:
+                    self.cond.wait()
+                if not self.running:
+                    return
+            self.merge_next()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def merge_next(self):
+        # Merge the oldest waiting submap
+        with self.cond:
+            submap = self.queue[0]
+        pos, cov, info, obs = self.map
+        N = len(pos)
+        M = len(submap.positions)
+        pos = np.concatenate((pos, submap.positions))
+        cov = np.concatenate((cov, submap.cov))
+        info = np.concatenate((info, submap.landmarks))
+        obs = np.concatenate((obs, submap.lm_obs))
+        rows = np.full(M, -1)                    # Map row each landmark of the submap ends up in
+        replaced = np.zeros(N, dtype=bool)
+        for k in np.nonzero(submap.origin >= 0)[0]:
+            j = self.last[submap.origin[k]]
+            if replaced[j]:
+                continue
+            pos[j], cov[j] = pos[N+k], cov[N+k]
+            info[j] = segment_union(info[j], info[N+k])
+            obs[j] = [obs[j,0] + obs[N+k,0] - self.last_count[submap.origin[k]], max(obs[j,1], obs[N+k,1])]
+            replaced[j] = True
+            rows[k] = j
+        n = N
+        fused = 0
+        for k in range(N, N+M):
+            if rows[k-N] >= 0:
+                continue
+            best = None
+            for j in self.grid.query(pos[k], self.merge_radius, pos[0:n]):
+                if j >= N or replaced[j]:
+                    continue
+                d = (info[j,1] - info[k,1]) % np.pi
+                if min(d, np.pi - d) > self.merge_angle:
+                    continue
+                if best is None or np.sum(np.square(pos[j] - pos[k])) < np.sum(np.square(pos[best] - pos[k])):
+                    best = j
+            if best is None:
+                # New to the map, rows are compacted over the fused ones as we go
+                pos[n], cov[n], info[n], obs[n] = pos[k], cov[k], info[k], obs[k]
+                self.grid.add(pos[n])
+                rows[k-N] = n
+                n = n + 1
+                continue
+            I_j = np.linalg.inv(cov[best])
+            I_k = np.linalg.inv(cov[k])
+            cov[best] = np.linalg.inv(I_j + I_k)
+            pos[best] = np.matmul(cov[best], np.matmul(I_j, pos[best]) + np.matmul(I_k, pos[k]))
+            info[best] = segment_union(info[best], info[k])
+            obs[best] = [obs[best,0] + obs[k,0], max(obs[best,1], obs[k,1])]
+            rows[k-N] = best
+            fused = fused + 1
+        self.grid.update(pos[0:n])
+        with self.cond:
+            self.map = (pos[0:n], cov[0:n], info[0:n], obs[0:n])
+            self.last = rows
+            self.last_count = submap.lm_obs[:,0].copy()
+            self.queue.popleft()
+            self.version = self.version + 1
+            self.merged = self.merged + 1
+            self.fused = self.fused + fused
+            self.replaced = self.replaced + int(np.sum(replaced))
+        debug_print('Merged submap %d: %d landmarks, %d replaced, %d fused, %d in the map', submap.index, M,
+                    int(np.sum(replaced)), fused, n)
+
+    def snapshot(self):
+        # Global map positions, line info and observation counts, with the submaps still waiting appended unfused,
+        # and the rows in them of the landmarks of the submap pushed last
+        with self.cond:
+            pos, cov, info, obs = self.map
+            waiting = list(self.queue)
+            last = self.last
+            version = self.version
+        if waiting:
+            pos = np.concatenate([pos] + [s.positions for s in waiting])
+            info = np.concatenate([info] + [s.landmarks for s in waiting])
+            obs = np.concatenate([obs] + [s.lm_obs for s in waiting])
+            last = np.arange(len(pos) - len(waiting[-1].positions), len(pos))
+        return pos, info, obs, last, version
+
+    def nbytes(self):
+        with self.cond:
+            return sum([a.nbytes for a in self.map]) + sum([s.nbytes() for s in self.queue])
+
+
+class SubmapSLAM():
+    ENGINE = 'submap'
+
+    def __init__(self, q=None, params=None):
+        self.poseInit = False
+        params = apply_params(self, params)
+        self.timer = StageTimer(params['profile'])   # Shared with every submap's filter
+        self.links = []                              # Base pose and covariance of every finished submap, in order
+        self.merger = MapMerger(params)
+        if self.submap_background:
+            self.merger.start()
+        self.world = np.zeros(3)                     # Base pose of the active submap in the world frame
+        self.base = np.zeros(3)                      # and in the previous submap's frame
+        self.base_cov = np.zeros((3,3))              # with its covariance
+        self.world_cov = np.zeros((3,3))             # Covariance of the world base pose, chained over the links
+        self.seed_cov = np.zeros((3,3))              # The same without the last link, see Submap
+        self.active = self._start_filter(params['P0'])
+        self.travelled = 0.0                         # Distance covered in the active submap
+        self.scan = 0                                # Landmark messages processed, over all submaps
+        self.scan_offset = 0                         # Value of scan when the active submap was started
+        self._log_likelihood = 0.0                   # Of the finished submaps
+        self._view = None                            # Cached x, landmarks and lm_obs
+        self.dX = None
+        self.dY = None
+        self.dT = None
+        self.q = q
+        self.time_delta = 0
+        self.t1 = None
+        self.data = {}
+        self.data['lm_info'] = None
+
+    def _start_filter(self, P0):
+        # Filter of a new submap with the robot at its origin
+        slam = LocalSLAM(params=dict(self.params, engine=SLAM.ENGINE, P0=P0, profile=False))
+        slam.timer = self.timer
+        slam.init_pose(0, 0, 0)
+        slam.dX = 0
+        slam.dY = 0
+        slam.dT = 0
+        slam.poseInit = True
+        return slam
+
+    # The message handling and stats are the same as SLAM's, around the methods below
+    odom_message = SLAM.odom_message
+    odom_messages = SLAM.odom_messages
+    stage_stats = SLAM.stage_stats
+
+    def init_pose(self, x, y, theta):
+        # The first submap starts at the initial pose
+        self.world = np.array([x, y, theta], dtype=float)
+        self.base = self.world.copy()
+        self._view = None
+
+    def odom_update(self, dx, dy, dt):
+        # Odometry comes in the world frame, the filter wants it in the submap's
+        c, s = np.cos(self.world[2]), np.sin(self.world[2])
+        self.active.time_delta = self.time_delta
+        self.active.odom_update(c*dx + s*dy, -s*dx + c*dy, dt)
+        self.travelled = self.travelled + np.sqrt(dx*dx + dy*dy)
+        if self._view is not None:
+            # Only the pose moved
+            self._view[0][0:3,0] = compose(self.world, self.active.x[0:3,0])
+        self.data['state'] = self.x
+        if self.q is not None:
+            t0 = self.timer.start()
+            self.q.put(self.data)
+            self.timer.stop('publish', t0)
+
+    def landmark_update(self, data):
+        self.scan = self.scan + 1
+        self.active.landmark_update(data)
+        if len(self.active.landmarks) >= self.submap_landmarks or \
+                (self.submap_distance > 0 and self.travelled >= self.submap_distance):
+            t0 = self.timer.start()
+            self.start_submap()
+            self.timer.stop('submap', t0)
+        self._view = None
+        self.data['state'] = self.x
+        self.data['lm_info'] = self.landmarks
+
+    def start_submap(self):
+        # Freeze the active submap, hand it to the merger and start the next one at the robot's pose
+        old = self.active
+        old.flush_odometry()
+        # The merger drops the submap once merged, only its link to the previous one is kept here
+        submap = Submap(len(self.links), self.base, self.world, self.world_cov, self.seed_cov, old, self.scan_offset)
+        self.links.append((self.base, self.base_cov))
+        self._log_likelihood = self._log_likelihood + old.log_likelihood
+        self.base = old.x[0:3,0].copy()
+        self.base_cov = old.cov.pose_block().copy()
+        J_world, J_base = compose_jacobians(self.world, self.base)
+        self.seed_cov = np.matmul(np.matmul(J_world, self.world_cov), np.transpose(J_world))
+        self.world_cov = self.seed_cov + np.matmul(np.matmul(J_base, self.base_cov), np.transpose(J_base))
+        self.world = compose(self.world, self.base)
+        self.active = self._start_filter(BASE_P0)
+        self._seed(old)
+        self.travelled = 0.0
+        self.scan_offset = self.scan
+        self.merger.push(submap)
+        if not self.submap_background:
+            self.merger.merge_next()
+        debug_print('Started submap %d at %s, %d landmarks left behind', len(self.links), self.world, len(submap.positions))
+
+    def _seed(self, old):
+        # Carry the confirmed landmarks of the old submap near the robot over into the new one, whose frame is
+        # the old pose. Their covariance follows from the joint one of the old pose and landmarks, so it holds
+        # the spread of the new base link (which Submap accounts for). The new pose starts at the origin of its
+        # own frame so they are uncorrelated with it
+        keep = np.nonzero(old.confirmed())[0]
+        lm = old.landmarks[keep]
+        dist = np.sqrt(np.sum(np.square(lm[:,2:4] - self.base[0:2]), axis=1)) - lm[:,0]
+        sel = np.nonzero(dist <= self.submap_seed_range)[0]
+        # The nearest ones, at most half the landmark budget so the new submap is not full before it starts
+        sel = np.sort(sel[np.argsort(dist[sel], kind='stable')][0:self.submap_landmarks//2])
+        K = len(sel)
+        if K == 0:
+            return
+        idx = keep[sel]
+        points, J_m, J_r = lines_into_frame(self.base, landmark_positions(old.x)[idx], lm[sel,1])
+        rows = np.concatenate((np.arange(3), (3 + 2*idx[:,None] + np.arange(2)).ravel()))
+        J = np.zeros((2*K, 3+2*K))
+        J[:,0:3] = J_r.reshape(2*K, 3)
+        for k in range(K):
+            J[2*k:2*k+2, 3+2*k:5+2*k] = J_m[k]
+        P = np.zeros((3+2*K, 3+2*K))
+        P[0:3,0:3] = np.diag(BASE_P0)
+        P[3:,3:] = np.matmul(np.matmul(J, old.P[np.ix_(rows, rows)]), np.transpose(J))
+        slam = self.active
+        slam._reserve(3+2*K)
+        slam._set_size(3+2*K)
+        slam.x[3:,0] = np.ravel(points)
+        slam.cov.restore({'P': P})
+        c, s = np.cos(self.base[2]), np.sin(self.base[2])
+        d = lm[sel,2:4] - self.base[0:2]
+        slam.landmarks[:,0] = lm[sel,0]
+        slam.landmarks[:,1] = lm[sel,1] - self.base[2]
+        slam.landmarks[:,2] = c*d[:,0] + s*d[:,1]
+        slam.landmarks[:,3] = -s*d[:,0] + c*d[:,1]
+        slam.lm_obs[:,0] = old.lm_obs[idx,0]
+        slam.lm_obs[:,1] = 0
+        slam.origin = sel
+        slam.grid.rebuild(landmark_positions(slam.x))
+        slam.data['state'] = slam.x
+        slam.data['lm_info'] = slam.landmarks
+
+    def _build_view(self):
+        # Global state [pose, map landmarks, active submap landmarks] in the world frame. Map landmarks the
+        # active submap was seeded with are left out, its own estimates of them are newer
+        slam = self.active
+        pos, info, obs, last, version = self.merger.snapshot()
+        shown = np.ones(len(pos), dtype=bool)
+        shown[last[slam.origin[slam.origin >= 0]]] = False
+        pos, info, obs = pos[shown], info[shown], obs[shown]
+        lm = slam.landmarks
+        act_pos = lines_to_frame(self.world, landmark_positions(slam.x), lm[:,1])[0]
+        act_info = lm.copy()
+        act_info[:,2:4], act_info[:,1] = segments_to_world(self.world, lm[:,2], lm[:,3], lm[:,1])
+        x = np.concatenate((compose(self.world, slam.x[0:3,0]), np.ravel(pos), np.ravel(act_pos))).reshape(-1,1)
+        self._view = (x, np.concatenate((info, act_info)), np.concatenate((obs, slam.lm_obs + [0, self.scan_offset])),
+                      version)
+
+    def _current(self):
+        if self._view is None or self._view[3] != self.merger.version:
+            self._build_view()
+        return self._view
+
+    @property
+    def x(self):
+        return self._current()[0]
+
+    @property
+    def landmarks(self):
+        return self._current()[1]
+
+    @property
+    def lm_obs(self):
+        return self._current()[2]
+
+    @property
+    def log_likelihood(self):
+        return self._log_likelihood + self.active.log_likelihood
+
+    def memory_usage(self):
+        memory = self.active.memory_usage()
+        memory['state'] = memory['state'] + self.merger.nbytes() + sum([b.nbytes + C.nbytes for b, C in self.links])
+        return memory
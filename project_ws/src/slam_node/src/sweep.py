@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Parameter sweep: replays one recorded log with many SLAM parameter sets, spread
+# over a process pool, and ranks them by trajectory error, throughput or innovation likelihood.
+# Usage: python sweep.py log [--grid r_t=0,0.1,0.25 v_r=1,3] [--sample 50 --range v_b=0.05:1]
+#                            [--base simple_slam] [--jobs N] [--rank error|throughput|likelihood] [--out sweep.csv]
+# List valued parameters (P0) are written with slashes, e.g. P0=0.1/0.1/0.78
+import os
+import csv
+import time
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+import slam_core
+from slam_core import make_filter, DEFAULT_PARAMS, SIMPLE_SLAM_PARAMS
+from replay import Replay, load_csv_log
+
+# Parameters a sweep would only waste runs on
+UNSWEPT = {'cov_float32': 'the filter drifts from the float64 one, see bench_covariance.py'}
+
+
+def parse_value(text, default):
+    # text as the type of the parameter's default value: counts like seif_active have to stay ints
+    if isinstance(default, list):
+        return [parse_value(v, default[0]) for v in text.split('/')]
+    if isinstance(default, bool):
+        if text.lower() not in ('true', 'false'):
+            raise ValueError('Expected true or false, got ' + text)
+        return text.lower() == 'true'
+    return type(default)(text)   # e.g. covariance=dense,packed or engine=ekf,seif stay strings
+
+
+def parse_specs(specs, sep):
+    # name=a<sep>b<sep>... pairs into {name: [a, b, ...]}
+    parsed = {}
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        if name not in DEFAULT_PARAMS:
+            raise ValueError('Unknown SLAM parameter ' + name)
+        if name in UNSWEPT:
+            raise ValueError(name + ' is not for sweeps: ' + UNSWEPT[name])
+        parsed[name] = values.split(sep)
+    return parsed
+
+
+def grid_configs(grid):
+    # Every combination of the listed values
+    names = sorted(grid)
+    values = [[parse_value(v, DEFAULT_PARAMS[name]) for v in grid[name]] for name in names]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def sample_configs(ranges, n, rng):
+    # n configurations drawn uniformly from low:high per parameter, integer parameters are rounded
+    configs = []
+    for _ in range(n):
+        config = {}
+        for name, (low, high) in sorted(ranges.items()):
+            value = rng.uniform(float(low), float(high))
+            config[name] = int(round(value)) if type(DEFAULT_PARAMS[name]) is int else value
+        configs.append(config)
+    return configs
+
+
+def load_events(path):
+    # Fresh events for every run, landmark_update writes to the landmark messages it is given
+    if os.path.isdir(path):
+        from recorder import LogReader
+        return LogReader(path).events()
+    return load_csv_log(path)
+
+
+def run_config(task):
+    index, path, base, params = task
+    start = time.time()
+    # Only a diverged filter is a failed run, anything else is a bug and stops the sweep
+    try:
+        replay = Replay(make_filter(params=dict(base, **params))).run(load_events(path))
+    except (np.linalg.LinAlgError, FloatingPointError) as e:
+        return {'index': index, 'params': params, 'error': str(e)}
+    elapsed = time.time() - start
+    traj = np.array(replay.trajectory).reshape(-1,5)
+    pos_err = np.sqrt(np.sum(np.square(traj[:,0:2] - traj[:,3:5]), axis=1))
+    return {'index': index, 'params': params, 'error': None,
+            'rmse': float(np.sqrt(np.mean(np.square(pos_err)))), 'final_err': float(pos_err[-1]),
+            'landmarks': len(replay.slam.landmarks), 'events_per_s': replay.steps/max(elapsed, 1e-9), 'time': elapsed,
+            'log_likelihood': float(replay.slam.log_likelihood)}
+
+
+def init_worker():
+    slam_core.am_debugging = False
+
+
+def rank_key(rank):
+    # Failed and diverged runs go last
+    if rank == 'throughput':
+        return lambda r: (r['error'] is not None, -r.get('events_per_s', 0))
+    if rank == 'likelihood':
+        return lambda r: (r['error'] is not None or not np.isfinite(r['log_likelihood']), -r.get('log_likelihood', 0))
+    return lambda r: (r['error'] is not None or not np.isfinite(r['rmse']), r.get('rmse', 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a log with many SLAM parameter sets in parallel')
+    parser.add_argument('log', help='data.csv style file or recorder.LogRecorder directory')
+    parser.add_argument('--grid', nargs='*', default=[], help='name=v1,v2,... values to take every combination of')
+    parser.add_argument('--range', nargs='*', default=[], help='name=low:high ranges for --sample')
+    parser.add_argument('--sample', type=int, default=0, help='number of random configurations drawn from --range')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--base', choices=['slam_node', 'simple_slam'], default='slam_node',
+                        help='parameter set the swept values override')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--rank', choices=['error', 'throughput', 'likelihood'], default='error')
+    parser.add_argument('--top', type=int, default=10, help='rows to print')
+    parser.add_argument('--out', default='sweep.csv')
+    args = parser.parse_args()
+
+    base = SIMPLE_SLAM_PARAMS if args.base == 'simple_slam' else DEFAULT_PARAMS
+    configs = grid_configs(parse_specs(args.grid, ','))
+    if args.sample > 0:
+        ranges = parse_specs(args.range, ':')
+        samples = sample_configs(ranges, args.sample, np.random.RandomState(args.seed))
+        # Sampled values are combined with each grid point
+        configs = [dict(c, **s) for c in configs for s in samples]
+    tasks = [(i, args.log, base, c) for i, c in enumerate(configs)]
+    print('Running %d configurations on %d processes' % (len(tasks), args.jobs))
+
+    start = time.time()
+    pool = multiprocessing.Pool(args.jobs, init_worker)
+    try:
+        results = list(pool.imap_unordered(run_config, tasks))
+    finally:
+        pool.close()
+        pool.join()
+    print('Done in %.1f s' % (time.time() - start))
+
+    results.sort(key=rank_key(args.rank))
+    names = sorted(set([name for c in configs for name in c]))
+    with open(args.out, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank'] + names + ['rmse', 'final_err', 'landmarks', 'events_per_s', 'log_likelihood', 'error'])
+        for rank, r in enumerate(results):
+            writer.writerow([rank] + [r['params'].get(name, '') for name in names] +
+                            [r.get('rmse', ''), r.get('final_err', ''), r.get('landmarks', ''),
+                             r.get('events_per_s', ''), r.get('log_likelihood', ''), r['error'] or ''])
+    for rank, r in enumerate(results[0:args.top]):
+        desc = ' '.join(['%s=%s' % (name, r['params'][name]) for name in names if name in r['params']])
+        if r['error'] is not None:
+            print('%3d  failed: %s  %s' % (rank, r['error'], desc))
+        else:
+            print('%3d  rmse %8.3f  final %8.3f  %6.0f events/s  %5d landmarks  %s' % (
+                rank, r['rmse'], r['final_err'], r['events_per_s'], r['landmarks'], desc))
+    print('Results written to ' + args.out)
+
+
+if __name__ == '__main__':
+    main()
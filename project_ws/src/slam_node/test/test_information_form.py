@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Map maintenance of the SEIF information form (seif.InformationForm) against the dense matrix algebra it
+# implements in place on the sparse rows. Run with nosetests or pytest, needs NumPy and SciPy.
+import os
+import sys
+import unittest
+import numpy as np
+import scipy.sparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from seif import InformationForm
+
+N_LANDMARKS = 6
+
+
+def random_information(rng):
+    # A sparse positive definite Omega of the pose and N_LANDMARKS landmarks: the pose is linked to every other
+    # landmark and landmark k to landmark k+1, as a chain of sparsified links would leave it
+    n = 3 + 2*N_LANDMARKS
+    links = np.zeros((n, n), dtype=bool)
+    links[0:3, 0:3] = True
+    for k in range(N_LANDMARKS):
+        i = 3 + 2*k
+        links[i:i+2, i:i+2] = True
+        if k % 2 == 0:
+            links[0:3, i:i+2] = True
+        if k + 1 < N_LANDMARKS:
+            links[i:i+2, i+2:i+4] = True
+    links = links | np.transpose(links)
+    A = rng.normal(size=(n, n))
+    A = np.where(links, np.matmul(A, np.transpose(A)), 0) + n*np.eye(n)
+    return 0.5*(A + np.transpose(A)), rng.normal(size=n)
+
+
+def make_form(A, xi):
+    form = InformationForm(len(xi), np.eye(3))
+    form.resize(len(xi))
+    form.Omega = scipy.sparse.lil_matrix(A)
+    form.xi[...] = xi
+    return form
+
+
+class TestInformationForm(unittest.TestCase):
+    def setUp(self):
+        self.A, self.xi = random_information(np.random.RandomState(0))
+
+    def test_fold(self):
+        # Rows and columns of b added to a's and cleared, for landmarks with and without a link between them
+        for i, j in [(1, 2), (0, 3), (4, 1)]:
+            a, b = 3 + 2*i, 3 + 2*j
+            form = make_form(self.A, self.xi)
+            form.fold(a, b)
+            B = self.A.copy()
+            B[a:a+2, :] += B[b:b+2, :]
+            B[:, a:a+2] += B[:, b:b+2]
+            B[b:b+2, :] = 0
+            B[:, b:b+2] = 0
+            xi = self.xi.copy()
+            xi[a:a+2] += xi[b:b+2]
+            xi[b:b+2] = 0
+            np.testing.assert_allclose(form.Omega.toarray(), B, atol=1e-12)
+            np.testing.assert_allclose(form.xi, xi, atol=1e-12)
+            for row in form.Omega.rows:
+                self.assertEqual(row, sorted(row))
+
+    def test_compact(self):
+        # Dropped landmarks are marginalized out: the Schur complement of their block
+        keep = np.concatenate((np.arange(3), np.arange(7, 11), np.arange(13, 15)))
+        drop = np.setdiff1d(np.arange(len(self.xi)), keep)
+        form = make_form(self.A, self.xi)
+        form.compact(keep)
+        form.resize(len(keep))
+        X = np.linalg.solve(self.A[np.ix_(drop, drop)], self.A[np.ix_(drop, keep)])
+        expected = self.A[np.ix_(keep, keep)] - np.matmul(self.A[np.ix_(keep, drop)], X)
+        np.testing.assert_allclose(form.Omega.toarray(), expected, atol=1e-9)
+        np.testing.assert_allclose(form.xi, self.xi[keep] - np.matmul(np.transpose(X), self.xi[drop]), atol=1e-9)
+        # The mean of what is kept does not change
+        np.testing.assert_allclose(form.mean(), np.linalg.solve(self.A, self.xi)[keep], atol=1e-9)
+
+    def test_fold_then_compact(self):
+        # The entries fold cleared carry no information and are dropped without touching the rest
+        a, b = 3 + 2*1, 3 + 2*4
+        form = make_form(self.A, self.xi)
+        form.fold(a, b)
+        folded = form.Omega.toarray()
+        keep = np.setdiff1d(np.arange(len(self.xi)), [b, b+1])
+        form.compact(keep)
+        form.resize(len(keep))
+        np.testing.assert_allclose(form.Omega.toarray(), folded[np.ix_(keep, keep)], atol=1e-12)
+
+    def test_blocks(self):
+        # The gate's covariance blocks: over the whole map they are the marginals, over part of it the inverse of
+        # Omega over the pose, the landmarks linked to it and the ones asked for
+        form = make_form(self.A, self.xi)
+        P = np.linalg.inv(self.A)
+        idx = np.arange(N_LANDMARKS)
+        Ppp, Ppm, Pmm = form.blocks(idx)
+        np.testing.assert_allclose(Ppp, P[0:3, 0:3], atol=1e-12)
+        for k in idx:
+            i = 3 + 2*k
+            np.testing.assert_allclose(Ppm[k], P[0:3, i:i+2], atol=1e-12)
+            np.testing.assert_allclose(Pmm[k], P[i:i+2, i:i+2], atol=1e-12)
+        # Landmarks 0, 2 and 4 are linked to the pose
+        S = np.array([0, 1, 2, 3, 4, 7, 8, 11, 12])
+        C = np.linalg.inv(self.A[np.ix_(S, S)])
+        Ppp, Ppm, Pmm = form.blocks(np.array([4]))
+        np.testing.assert_allclose(Ppp, C[0:3, 0:3], atol=1e-12)
+        np.testing.assert_allclose(Ppm[0], C[0:3, 7:9], atol=1e-12)
+        np.testing.assert_allclose(Pmm[0], C[7:9, 7:9], atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Author : Joseph Grant
+# Observation and change of frame Jacobians of the filter against finite differences of the models they
+# linearize. Run with nosetests or pytest, only needs NumPy.
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from line_model import (wrap_angles, hesse_from_points, closest_points, predict_lines, align_observations,
+                        lines_to_frame, lines_into_frame)
+
+STEP = 1e-6
+
+
+def numeric_jacobian(f, x):
+    # Central differences of f (N,rows) with respect to every entry of x, shape (N,rows,len(x))
+    cols = []
+    for k in range(len(x)):
+        dx = np.zeros(len(x))
+        dx[k] = STEP
+        cols.append((f(x + dx) - f(x - dx))/(2*STEP))
+    return np.stack(cols, axis=-1)
+
+
+def lines_from_robot(pose, z):
+    # World closest points of robot frame lines z (N,2), the inverse of predict_lines
+    phi = z[:, 1] + pose[2]
+    rho = z[:, 0] + pose[0]*np.cos(phi) + pose[1]*np.sin(phi)
+    return closest_points(rho, phi)
+
+
+class TestLineModel(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.pose = np.array([0.7, -1.3, 2.5])
+        self.points = rng.uniform(-5, 5, (20, 2))
+        self.alpha = np.arctan2(self.points[:, 1], self.points[:, 0]) + np.pi/2
+
+    def test_pose_part(self):
+        Hx = predict_lines(self.pose, self.points, self.alpha)[1]
+        numeric = numeric_jacobian(lambda pose: predict_lines(pose, self.points, self.alpha)[0], self.pose)
+        np.testing.assert_allclose(Hx, numeric, atol=1e-6)
+
+    def test_landmark_part(self):
+        Hm = predict_lines(self.pose, self.points, self.alpha)[2]
+        for i in range(len(self.points)):
+            def predict_one(p):
+                return predict_lines(self.pose, p.reshape(1, 2), self.alpha[i:i+1])[0][0]
+            numeric = numeric_jacobian(predict_one, self.points[i])
+            np.testing.assert_allclose(Hm[i], numeric, atol=1e-6)
+
+    def test_observation_round_trip(self):
+        # A segment seen from the pose, placed in the world and predicted again is the line it was seen as
+        rng = np.random.RandomState(1)
+        lx, ly = rng.uniform(-4, 4, 20), rng.uniform(-4, 4, 20)
+        direction = rng.uniform(-np.pi, np.pi, 20)
+        z = np.column_stack(hesse_from_points(lx, ly, direction))
+        pred = predict_lines(self.pose, lines_from_robot(self.pose, z), direction + self.pose[2])[0]
+        z = align_observations(z, pred)
+        np.testing.assert_allclose(z[:, 0], pred[:, 0], atol=1e-9)
+        np.testing.assert_allclose(wrap_angles(z[:, 1] - pred[:, 1]), 0, atol=1e-9)
+
+    def test_initialization(self):
+        # The landmark Jacobians by the observation and the pose are Hm^-1 and -Hm^-1*Hx (see SLAM._init_landmark)
+        pred, Hx, Hm = predict_lines(self.pose, self.points, self.alpha)
+        for i in range(len(self.points)):
+            Jz = np.linalg.inv(Hm[i])
+            numeric = numeric_jacobian(lambda z: lines_from_robot(self.pose, z.reshape(1, 2))[0], pred[i])
+            np.testing.assert_allclose(Jz, numeric, atol=1e-5)
+            numeric = numeric_jacobian(lambda pose: lines_from_robot(pose, pred[i:i+1])[0], self.pose)
+            np.testing.assert_allclose(-np.matmul(Jz, Hx[i]), numeric, atol=1e-5)
+
+
+class TestChangeOfFrame(unittest.TestCase):
+    # lines_to_frame and lines_into_frame move submap landmarks between frames
+    def setUp(self):
+        rng = np.random.RandomState(2)
+        self.pose = np.array([1.5, -2.0, 0.9])
+        self.points = rng.normal(0, 3, (6, 2))
+        self.alpha = rng.uniform(0, 3, 6)
+
+    def check(self, f):
+        out, J_points, J_pose = f(self.pose, self.points, self.alpha)
+        numeric = numeric_jacobian(lambda pose: f(pose, self.points, self.alpha)[0], self.pose)
+        np.testing.assert_allclose(J_pose, numeric, atol=1e-6)
+        for i in range(len(self.points)):
+            numeric = numeric_jacobian(lambda p: f(self.pose, p.reshape(1, 2), self.alpha[i:i+1])[0][0], self.points[i])
+            np.testing.assert_allclose(J_points[i], numeric, atol=1e-6)
+
+    def test_to_frame(self):
+        self.check(lines_to_frame)
+
+    def test_into_frame(self):
+        self.check(lines_into_frame)
+
+    def test_round_trip(self):
+        back = lines_into_frame(self.pose, lines_to_frame(self.pose, self.points, self.alpha)[0], self.alpha + self.pose[2])[0]
+        np.testing.assert_allclose(back, self.points, atol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()